@@ -5,11 +5,16 @@ import os
 import sys
 from subprocess import check_output
 
+from util.files import open_file, uncompressed_path
+
 def run_evaluation_script(fn_gold, fn_sys, print_output=False):
-    args = ['perl', 'eval/eval09.pl', '-g', fn_gold, '-s', fn_sys, '-q']
-    with open(os.devnull, 'w') as devnull:
-        output = check_output(args, stderr=devnull)
-        output = output.decode('utf-8')
+    # The perl script can't read compressed files
+    with uncompressed_path(fn_gold) as fn_gold, \
+         uncompressed_path(fn_sys) as fn_sys:
+        args = ['perl', 'eval/eval09.pl', '-g', fn_gold, '-s', fn_sys, '-q']
+        with open(os.devnull, 'w') as devnull:
+            output = check_output(args, stderr=devnull)
+            output = output.decode('utf-8')
     if print_output:
         print(output)
     # Just want to return labeled and unlabeled semantic F1 scores
@@ -61,10 +66,10 @@ def get_f1(predicted, gold):
 
 
 def get_f1_from_files(fn_pred, fn_gold):
-    with open(fn_pred, 'r') as f_pred:
+    with open_file(fn_pred) as f_pred:
         lines = f_pred.read().split('\n')
         predicted = [line for line in lines if line != '']
-    with open(fn_gold, 'r') as f_gold:
+    with open_file(fn_gold) as f_gold:
         lines = f_gold.read().split('\n')
         gold = [line for line in lines if line != '']
     return get_f1(predicted, gold)
@@ -11,6 +11,7 @@ from model import layers, lstm
 from util.data_loader import disamb_batch_producer
 from util.conll_io import get_lemma_to_preds
 from eval.eval import get_f1_from_files
+from util.files import open_file
 
 
 class Redirect(object):
@@ -23,17 +24,18 @@ class Redirect(object):
 class DisambModel(object):
     def __init__(self, vocabs, args):
         self.args = args
-        batch_size = args.batch_size
 
         # Input placeholders
-        words_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        pos_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        lemmas_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        labels_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        stags_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        fill_preds_placeholder = tf.placeholder(tf.int32,
-                                                shape=(batch_size, None))
+        ## The batch dimension is dynamic, so batches can vary in size
+        ##   (see --max_tokens)
+        words_placeholder = tf.placeholder(tf.int32, shape=(None, None))
+        pos_placeholder = tf.placeholder(tf.int32, shape=(None, None))
+        lemmas_placeholder = tf.placeholder(tf.int32, shape=(None, None))
+        labels_placeholder = tf.placeholder(tf.int32, shape=(None, None))
+        stags_placeholder = tf.placeholder(tf.int32, shape=(None, None))
+        fill_preds_placeholder = tf.placeholder(tf.int32, shape=(None, None))
         use_dropout_placeholder = tf.placeholder(tf.float32, shape=())
+        batch_size = tf.shape(words_placeholder)[0]
 
         # Word representation
 
@@ -105,7 +107,7 @@ class DisambModel(object):
             cell=lstm.HighwayLSTMCell,
             input_size=input_size,
             state_size=args.state_size,
-            batch_size=args.batch_size,
+            batch_size=batch_size,
             num_layers=args.num_layers,
             dropout=dropout,
             recurrent_dropout=recurrent_dropout)
@@ -233,7 +235,9 @@ class DisambModel(object):
         if self.training_batches is None:
             print('Loading training batches...')
             self.training_batches = [batch for batch in disamb_batch_producer(
-                batch_size, vocabs, fn_txt, fn_stags, language, train=True)]
+                batch_size, vocabs, fn_txt, fn_stags, language, train=True,
+                num_workers=getattr(self.args, 'num_workers', 1),
+                max_tokens=getattr(self.args, 'max_tokens', 0))]
             print('Loaded {} training batches'.format(
                 len(self.training_batches)))
         total_batches = len(self.training_batches)
@@ -244,7 +248,7 @@ class DisambModel(object):
             num_batches += 1
             if i % 10 == 0:
                 avg_loss = total_loss / num_batches
-                batch_size = len(batch[0][1])
+                batch_size = len(batch[0])
                 msg = '\r{}/{}    loss: {}    batch_size: {}'.format(
                     i, total_batches, avg_loss, batch_size)
                 sys.stdout.write(msg)
@@ -263,7 +267,9 @@ class DisambModel(object):
         if self.testing_batches is None:
             print('Loading testing batches...')
             self.testing_batches = [batch for batch in disamb_batch_producer(
-                batch_size, vocabs, fn_txt, fn_stags, language, train=False)]
+                batch_size, vocabs, fn_txt, fn_stags, language, train=False,
+                num_workers=getattr(self.args, 'num_workers', 1),
+                max_tokens=getattr(self.args, 'max_tokens', 0))]
             print('Loaded {} testing batches.'.format(
                 len(self.testing_batches)))
         total_batches = len(self.testing_batches)
@@ -275,7 +281,7 @@ class DisambModel(object):
         predicted_predicates = []
         predicted_sents = set()
         fn_sys = 'test.txt'
-        f_out = open(fn_sys, 'w')
+        f_out = open_file(fn_sys, 'w')
         for i, (sents, batch) in enumerate(self.testing_batches):
             batch_loss, probabilities = self.run_testing_batch(session, batch)
             total_loss += batch_loss            
@@ -356,14 +362,5 @@ class DisambModel(object):
         """
         fn = 'data/{}/conll09/train.txt'.format(language)
         lemma_to_preds = get_lemma_to_preds(fn)
-        masks = np.zeros((vocabs['plemmas'].size, vocabs['predicates'].size),
-                         dtype=np.float32)
-        for i, lemma in vocabs['plemmas'].idx_to_word.iteritems():
-            if lemma in lemma_to_preds:
-                preds = lemma_to_preds[lemma]
-                idxs = vocabs['predicates'].encode_sequence(preds)
-                for j in idxs:
-                    masks[i][j] = 1.0
-            else:
-                masks[i, :] = 1.0 # Allow everything
-        return masks
+        # Lemmas that weren't seen with any predicate allow everything
+        return lemma_to_preds.masks(vocabs['plemmas'], vocabs['predicates'])
@@ -92,6 +92,14 @@ parser.add_argument("--optimizer",
 parser.add_argument("--restrict_labels",
                     help="Restrict predicates by lemma",
                     action="store_true", default=True)
+parser.add_argument("--max_tokens",
+                    help="Size batches to hold at most this many (padded) "
+                         "tokens instead of --batch_size instances. "
+                         "0 uses --batch_size",
+                    type=int, default=0)
+parser.add_argument("--num_workers",
+                    help="Number of processes for parsing the data files",
+                    type=int, default=1)
 parser.add_argument("--debug",
                     help="Use a smaller configuration for debugging",
                     action="store_true", default=False)
@@ -120,6 +128,8 @@ class Debug_Args(object):
         self.use_word_dropout = True
         self.use_highway_lstm = True
         self.optimizer = 'adam'
+        self.num_workers = 1
+        self.max_tokens = 0
     
 
 def train(args):
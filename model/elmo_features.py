@@ -0,0 +1,71 @@
+# elmo_features.py
+# Precomputes the ELMo layer outputs for every sentence of a split with the
+# ELMo module, and saves them to a memory-mapped cache (see
+# util/elmo_cache.py) for training and testing with --elmo_cache
+#   python model/elmo_features.py eng train dev test
+from __future__ import print_function
+from __future__ import division
+
+import sys, os
+import argparse
+import tensorflow as tf
+
+import layers
+sys.path.append(os.getcwd())
+from util.corpus import read_corpus
+from util.elmo_cache import get_elmo_cache_dir, get_elmo_meta
+from util.elmo_cache import write_elmo_cache, get_elmo_cache
+
+
+parser = argparse.ArgumentParser(
+    description="Precompute ELMo features for --elmo_cache")
+parser.add_argument("language", help="Language of the data, e.g. eng")
+parser.add_argument("splits", nargs='+',
+                    help="Splits to compute, e.g. train dev test")
+parser.add_argument("--elmo_module",
+                    help="Local directory (or URL) of the ELMo module",
+                    default=None)
+parser.add_argument("--batch_size",
+                    help="Number of sentences to run through ELMo at once",
+                    type=int, default=32)
+parser.add_argument("--force",
+                    help="Recompute features that are already up to date",
+                    action="store_true", default=False)
+
+
+def precompute_elmo(fn_txt, language='eng', batch_size=32, module=None,
+                    force=False):
+    """
+    Computes the ELMo cache of a text file unless it is already up to date.
+    Builds its own graph, so call it before building the model.
+    """
+    module = layers.get_elmo_module(module)
+    if not force and get_elmo_cache(fn_txt, module) is not None:
+        return
+    print('Computing ELMo features for {}...'.format(fn_txt))
+    ## ELMo only needs the words, so the text file stands in for the
+    ## predicate and supertag files
+    corpus = read_corpus(fn_txt, fn_txt, fn_txt, language)
+    with tf.Graph().as_default():
+        tokens = tf.placeholder(tf.string, shape=(None, None))
+        lengths = tf.placeholder(tf.int32, shape=(None,))
+        outputs = layers.add_elmo(tokens, lengths, module, all_layers=True)
+        with tf.Session() as session:
+            session.run([tf.global_variables_initializer(),
+                         tf.tables_initializer()])
+
+            def compute(batch_tokens, batch_lengths):
+                return session.run(outputs, feed_dict={
+                    tokens: batch_tokens, lengths: batch_lengths})
+
+            write_elmo_cache(get_elmo_cache_dir(fn_txt), corpus, compute,
+                             get_elmo_meta(fn_txt, module), batch_size)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    for split in args.splits:
+        fn_txt = 'data/{}/conll09/{}.txt'.format(args.language, split)
+        precompute_elmo(fn_txt, args.language, args.batch_size,
+                        args.elmo_module, args.force)
+        print('Saved to', get_elmo_cache_dir(fn_txt))
@@ -1,7 +1,24 @@
 # Neural-network layers for the SRL model
+import os, sys
 import numpy as np
 import tensorflow as tf
-import tensorflow_hub as hub
+sys.path.append(os.getcwd())
+from util.files import open_file
+
+## The default ELMo module, the size of its output vectors, and the number
+## of layers it mixes (the character CNN and two LSTM layers)
+ELMO_MODULE = "https://tfhub.dev/google/elmo/2"
+ELMO_DIM = 1024
+ELMO_LAYERS = 3
+
+
+def get_elmo_module(module=None):
+    """
+    The ELMo module to load: `module` (e.g. --elmo_module) if given, else
+    $ELMO_MODULE, else the module on tfhub.dev. A path to a downloaded and
+    unpacked copy of the module works offline.
+    """
+    return module or os.environ.get('ELMO_MODULE') or ELMO_MODULE
 
 
 def get_word_embeddings(language, idx_to_word, embed_size):
@@ -11,7 +28,7 @@ def get_word_embeddings(language, idx_to_word, embed_size):
     """
     fn='data/{}/embeddings/sskip.{}.vectors'.format(language, embed_size)
     word_to_vec = {}
-    with open(fn, 'r') as f:
+    with open_file(fn) as f:
         for line in f:
             parts = line.strip().split(' ')
             word = parts[0]
@@ -53,18 +70,48 @@ def embed_inputs(raw_inputs,
         inputs = tf.nn.embedding_lookup(embeddings, raw_inputs)
         return inputs
 
-def add_elmo(raw_inputs, seq_lengths):
-    elmo = hub.Module("https://tfhub.dev/google/elmo/2", trainable=True)
+def add_elmo(raw_inputs, seq_lengths, module=None, all_layers=False):
+    """
+    ELMo vectors for padded sentences of tokens, shaped (batch_size,
+    seq_length, ELMO_DIM). With all_layers, returns each of ELMo's layers
+    instead of their (trained) mix: (batch_size, seq_length, ELMO_LAYERS,
+    ELMO_DIM), see scalar_mix.
+    """
+    ## Only needed when ELMo runs in the graph (not with --elmo_cache)
+    import tensorflow_hub as hub
+    elmo = hub.Module(get_elmo_module(module), trainable=True)
     #"http://files.deeppavlov.ai/deeppavlov_data/elmo_ru-news_wmt11-16_1.5M_steps.tar.gz"
-    inputs = elmo(
+    outputs = elmo(
         inputs={
                 "tokens": raw_inputs,
                 "sequence_len": seq_lengths
                 },
                 signature="tokens",
-                as_dict=True)["elmo"]
-    #inputs = tf.transpose(inputs, perm=[1, 0, 2]) # [seq_length, batch_size, embedding_dim]
-    return inputs 
+                as_dict=True)
+    if not all_layers:
+        #inputs = tf.transpose(inputs, perm=[1, 0, 2]) # [seq_length, batch_size, embedding_dim]
+        return outputs["elmo"]
+    # Like ELMo itself, the character CNN output is doubled to match the
+    # size of the LSTM layers
+    word_emb = outputs["word_emb"]
+    return tf.stack([tf.concat([word_emb, word_emb], axis=-1),
+                     outputs["lstm_outputs1"], outputs["lstm_outputs2"]],
+                    axis=2)
+
+
+def scalar_mix(layer_vectors, name='elmo_mix'):
+    """
+    ELMo's weighted sum of its layers, with softmax-normalized weights and
+    a scale, both trained (initialized like the module's own).
+    layer_vectors: (batch_size, seq_length, ELMO_LAYERS, dim)
+    """
+    with tf.variable_scope(name):
+        weights = tf.get_variable('weights', shape=(ELMO_LAYERS,),
+                                  initializer=tf.zeros_initializer())
+        gamma = tf.get_variable('gamma', shape=(),
+                                initializer=tf.ones_initializer())
+    weights = tf.expand_dims(tf.nn.softmax(weights), 1)
+    return gamma * tf.reduce_sum(layer_vectors * weights, axis=2)
 
 
 def batch_matmul(x, W):
@@ -11,6 +11,17 @@ import tensorflow as tf
 import collections
 import initialize
 
+
+def state_shape(batch_size, state_size):
+    """
+    Shape of a (batch_size, state_size) state. batch_size can be a scalar
+    tensor (e.g. tf.shape(inputs)[1]) for a dynamic batch dimension.
+    """
+    if isinstance(batch_size, tf.Tensor):
+        return tf.stack([batch_size, state_size])
+    return (batch_size, state_size)
+
+
 class LSTMCell(object):
     def set_dropout_mask(self):
         # dropout mask to apply recurrent dropout to lstm state
@@ -39,12 +50,13 @@ class LSTMCell(object):
         self.b_init = tf.constant_initializer(init_b)
 
         # Define the zero state
-        c_init = tf.zeros((batch_size, state_size), dtype=tf.float32)
-        h_init = tf.zeros((batch_size, state_size), dtype=tf.float32)
+        shape = state_shape(batch_size, state_size)
+        c_init = tf.zeros(shape, dtype=tf.float32)
+        h_init = tf.zeros(shape, dtype=tf.float32)
         self.zero_state = tf.stack([c_init, h_init])
 
         self.dropout = dropout
-        self.dropout_ones = tf.ones((batch_size, state_size), dtype=tf.float32)
+        self.dropout_ones = tf.ones(shape, dtype=tf.float32)
         self.set_dropout_mask()
 
         
@@ -118,12 +130,13 @@ class HighwayLSTMCell(LSTMCell):
         self.b_init = tf.constant_initializer(init_b)
 
         # Define the zero state
-        c_init = tf.zeros((batch_size, state_size), dtype=tf.float32)
-        h_init = tf.zeros((batch_size, state_size), dtype=tf.float32)
+        shape = state_shape(batch_size, state_size)
+        c_init = tf.zeros(shape, dtype=tf.float32)
+        h_init = tf.zeros(shape, dtype=tf.float32)
         self.zero_state = tf.stack([c_init, h_init])
         
         self.dropout = dropout
-        self.dropout_ones = tf.ones((batch_size, state_size), dtype=tf.float32)
+        self.dropout_ones = tf.ones(shape, dtype=tf.float32)
         self.set_dropout_mask()
 
         
@@ -198,7 +211,6 @@ class BiLSTM(object):
                 2 * state_size, state_size, batch_size, recurrent_dropout))
         self.zero_state = tf.stack([c.zero_state for c in self.cells])
         self.dropout = dropout
-        self.noise_shape = (1, batch_size, 2 * state_size)
 
     def __call__(self, inputs, init_state=None):
         if init_state is None:
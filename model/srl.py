@@ -10,7 +10,12 @@ import tensorflow as tf
 
 import layers, lstm, stags
 sys.path.append(os.getcwd())
-from util.data_loader import batch_producer
+from util.data_loader import corpus_batch_plan, make_batch_from_corpus
+from util.data_loader import load_corpus, PaddingStats
+from util.batch_store import get_batch_store
+from util.elmo_cache import get_elmo_cache
+from util.prefetch import Prefetcher
+from util.corpus import PredictionWriter
 from tensorflow.python.client import timeline
 from timeit import default_timer as timer
 
@@ -23,14 +28,50 @@ class Redirect(object):
         pass
 
 
+# Types and shapes of the arrays in a batch, in order (see make_batch).
+# With --elmo_cache the first one holds ELMo's layer outputs instead of
+# tokens.
+BATCH_TYPES = (tf.string, tf.int32, tf.int32, tf.int32, tf.int32, tf.int32,
+               tf.int32, tf.int32, tf.float32, tf.int32, tf.int32, tf.int32)
+
+
+def batch_types(args):
+    if getattr(args, 'elmo_cache', False):
+        return (tf.float32,) + BATCH_TYPES[1:]
+    return BATCH_TYPES
+
+
+def batch_shapes(vocabs, args):
+    if getattr(args, 'elmo_cache', False):
+        elmo_shape = (None, None, layers.ELMO_LAYERS, layers.ELMO_DIM)
+    else:
+        elmo_shape = (None, None)
+    return [elmo_shape, (None, None), (None, None), (None, None),
+            (None, None), (None,), (None,), (None, None),
+            (None, vocabs['labels'].size), (None, None), (None,), (None,)]
+
+
+def input_placeholder(dtype, shape, default=None):
+    """
+    A placeholder, or if `default` (a tensor from the tf.data pipeline) is
+    given one that reads from it unless fed (see make_input_iterator)
+    """
+    if default is None:
+        return tf.placeholder(dtype, shape=shape)
+    return tf.placeholder_with_default(default, shape=shape)
+
+
 class SRL_Model(object):
     def __init__(self, vocabs, args):
         self.args = args
-        batch_size = args.batch_size
+        self.input_source = None
+        self.input_iterator = None
 
         # Input placeholders
         ## Inputs are shaped (batch_size, seq_length) unless the input
         ##   applies to the whole sentence (e.g. predicate)
+        ## The batch dimension is dynamic, so batches can vary in size
+        ##   (see --max_tokens)
         ## words: sequences of word ids
         ## pos: predicted parts of speech
         ## lemmas: lemma ids for the predicates, 0's for the other words
@@ -39,20 +80,26 @@ class SRL_Model(object):
         ## labels: semantic role label for each word in the sequence
         ## labels_mask: mask invalid arg labels (given the predicate)
         ## stags_placeholder: a UD supertag for each word
+        ## elmo: the tokens (or with --elmo_cache, the precomputed ELMo
+        ##   layer outputs) of each distinct sentence in the batch
+        ## elmo_idx: the index of each instance's sentence in elmo
         ## use_dropout_placeholder: 0.0 or 1.0, whether or not to use dropout
-        words_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        freqs_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        pos_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        lemmas_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        preds_placeholder = tf.placeholder(tf.int32, shape=(batch_size,))
-        preds_idx_placeholder = tf.placeholder(tf.int32, shape=(batch_size,))
-        labels_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        labels_mask_placeholder = tf.placeholder(
-            tf.float32, shape=(batch_size, vocabs['labels'].size))
-        stags_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
+        ## With --use_dataset the inputs default to the next batch from a
+        ##   tf.data iterator, so only use_dropout needs to be fed
+        if getattr(args, 'use_dataset', False):
+            inputs = self.make_input_iterator(vocabs)
+        else:
+            inputs = [None] * len(BATCH_TYPES)
+        (elmo_placeholder, words_placeholder, freqs_placeholder,
+         pos_placeholder, lemmas_placeholder, preds_placeholder,
+         preds_idx_placeholder, labels_placeholder, labels_mask_placeholder,
+         stags_placeholder, seq_lengths_placeholder,
+         elmo_idx_placeholder) = [
+            input_placeholder(dtype, shape, default)
+            for dtype, shape, default in zip(
+                batch_types(args), batch_shapes(vocabs, args), inputs)]
         use_dropout_placeholder = tf.placeholder(tf.float32, shape=())
-        seq_lengths_placeholder = tf.placeholder(tf.int32, shape=(batch_size,))
-        elmo_placeholder = tf.placeholder(tf.string, shape=(batch_size, None))
+        batch_size = tf.shape(words_placeholder)[0]
 
         # Word representation
 
@@ -73,7 +120,18 @@ class SRL_Model(object):
             vocab_size=vocabs['words'].size,
             embed_size=args.word_embed_size,
             name='word_embedding')
-        elmo_embeddings = layers.add_elmo(elmo_placeholder, seq_lengths_placeholder)
+        ## ELMo runs once per distinct sentence, and each predicate instance
+        ## gathers the vectors of its sentence
+        ## (with --elmo_cache, only the mix of its layers is computed here)
+        if getattr(args, 'elmo_cache', False):
+            sent_elmo = layers.scalar_mix(elmo_placeholder)
+        else:
+            sent_lengths = tf.unsorted_segment_max(
+                seq_lengths_placeholder, elmo_idx_placeholder,
+                tf.shape(elmo_placeholder)[0])
+            sent_elmo = layers.add_elmo(elmo_placeholder, sent_lengths,
+                                        getattr(args, 'elmo_module', None))
+        elmo_embeddings = tf.gather(sent_elmo, elmo_idx_placeholder)
 
         ## Pretrained word embeddings
         pretr_word_vectors = layers.get_word_embeddings(
@@ -129,17 +187,8 @@ class SRL_Model(object):
                                                  seq_length,
                                                  dtype=tf.float32),
                                       axis=-1)
-        word_features.append(pred_markers)
-        
-        ## Concatenate all the word features on the last dimension
-        inputs = tf.concat(word_features, axis=2)
-        input_size = inputs.shape[2]
-        
-        # BiLSTM
 
-        ## (num_steps, batch_size, embed_size)
-        ## num_steps has to be first because LSTM scans over the 1st dimension
-        lstm_inputs = tf.transpose(inputs, perm=[1,0,2])
+        # BiLSTM
 
         ## use_dropout_placeholder is 0 or 1, so this just turns dropout
         ## on or off
@@ -152,16 +201,57 @@ class SRL_Model(object):
         else:
             cell = lstm.LSTMCell
 
-        bilstm = lstm.BiLSTM(
-            cell=cell,
-            input_size=input_size,
-            state_size=args.state_size,
-            batch_size=args.batch_size,
-            num_layers=args.num_layers,
-            dropout=dropout,
-            recurrent_dropout=recurrent_dropout)
-        
-        lstm_outputs = bilstm(lstm_inputs)
+        def run_bilstm(inputs, num_layers, batch_size):
+            """
+            inputs: (batch_size, num_steps, input_size)
+            Returns the outputs shaped (num_steps, batch_size, output_size)
+            """
+            ## (num_steps, batch_size, embed_size)
+            ## num_steps has to be first because LSTM scans over the 1st
+            ## dimension
+            lstm_inputs = tf.transpose(inputs, perm=[1,0,2])
+            bilstm = lstm.BiLSTM(
+                cell=cell,
+                input_size=inputs.shape[2],
+                state_size=args.state_size,
+                batch_size=batch_size,
+                num_layers=num_layers,
+                dropout=dropout,
+                recurrent_dropout=recurrent_dropout)
+            return bilstm(lstm_inputs)
+
+        ## With --sentence_layers K, the lower K layers don't see the
+        ## predicate marker (the lemma embeddings mark every predicate of
+        ## the sentence), so they run once per distinct sentence in the
+        ## batch, and each predicate instance gathers the outputs of its
+        ## sentence. The marker joins in above them, so only the upper
+        ## layers (or with K == num_layers, just the projection) run per
+        ## predicate.
+        sentence_layers = min(getattr(args, 'sentence_layers', 0),
+                              args.num_layers)
+        if sentence_layers > 0:
+            ## The first instance of each sentence stands in for it
+            num_sents = tf.shape(elmo_placeholder)[0]
+            sent_rows = tf.unsorted_segment_min(
+                tf.range(batch_size), elmo_idx_placeholder, num_sents)
+            sent_inputs = tf.gather(tf.concat(word_features, axis=2),
+                                    sent_rows)
+            with tf.variable_scope('sentence'):
+                sent_outputs = run_bilstm(sent_inputs, sentence_layers,
+                                          num_sents)
+            lstm_outputs = tf.gather(sent_outputs, elmo_idx_placeholder,
+                                     axis=1)
+            if args.num_layers > sentence_layers:
+                ## Back to (batch_size, num_steps, output_size)
+                inputs = tf.concat([tf.transpose(lstm_outputs, perm=[1,0,2]),
+                                    pred_markers], axis=2)
+                lstm_outputs = run_bilstm(
+                    inputs, args.num_layers - sentence_layers, batch_size)
+        else:
+            word_features.append(pred_markers)
+            ## Concatenate all the word features on the last dimension
+            inputs = tf.concat(word_features, axis=2)
+            lstm_outputs = run_bilstm(inputs, args.num_layers, batch_size)
 
         ## Transpose back to (batch_size, num_steps, embed_size)
         outputs = tf.transpose(lstm_outputs, perm=[1, 0, 2])
@@ -293,14 +383,77 @@ class SRL_Model(object):
         self.loss = loss
         self.train_op = train_op
 
+        self.training_plan = None
         self.training_batches = None
+        self.training_corpus = None
+        self.training_stats = None
+        self.training_epoch = 0
+        self.training_store = None
+        self.training_elmo_cache = None
+        self.testing_plan = None
         self.testing_batches = None
+        self.testing_corpus = None
+        self.testing_stats = None
         self.elmo_placeholder = elmo_placeholder
+        self.elmo_idx_placeholder = elmo_idx_placeholder
+        ## Sentence layers need all of a sentence's predicates in one batch
+        self.by_sentence = sentence_layers > 0
+
+
+    def make_input_iterator(self, vocabs):
+        """
+        The tf.data input pipeline for --use_dataset: a dataset of batch
+        numbers for the current plan (see dataset_batches) is mapped to
+        batches by --input_threads parallel calls (keeping their order),
+        and prefetched --prefetch_depth batches ahead (at least one).
+        Returns the tensors of the next batch.
+        """
+        def make_input_batch(i):
+            corpus, plan, train, batches = self.input_source
+            if batches is not None:
+                batch = batches[i][1]
+            else:
+                batch = make_batch_from_corpus(corpus, plan[i], vocabs, train)
+            ## tf.string tensors have to come from byte strings
+            if batch[0].dtype.kind == 'U':
+                batch = (np.char.encode(batch[0], 'utf-8'),) + batch[1:]
+            return tuple(batch)
+
+        dataset = tf.data.Dataset.from_generator(
+            lambda: range(len(self.input_source[1])), tf.int64,
+            tf.TensorShape([]))
+        dataset = dataset.map(
+            lambda i: tf.py_func(make_input_batch, [i],
+                                 batch_types(self.args)),
+            num_parallel_calls=getattr(self.args, 'input_threads', 2))
+        dataset = dataset.prefetch(
+            max(getattr(self.args, 'prefetch_depth', 0), 1))
+        self.input_iterator = dataset.make_initializable_iterator()
+        batch = self.input_iterator.get_next()
+        for tensor, shape in zip(batch, batch_shapes(vocabs, self.args)):
+            tensor.set_shape(shape)
+        return batch
+
+
+    def dataset_batches(self, session, corpus, plan, train, batches=None):
+        """
+        Starts the tf.data pipeline on `plan`, and yields (instances, None)
+        for each batch: the model reads the batch itself from the iterator,
+        so exactly one step has to be run per batch.
+        If `batches` (already made for `plan`) is given, those are fed
+        instead of making them again.
+        """
+        self.input_source = (corpus, plan, train, batches)
+        session.run(self.input_iterator.initializer)
+        for sents in plan:
+            yield sents, None
 
 
     def batch_to_feed(self, batch):
+        if batch is None:
+            return {}
         (elmo, words, freqs, pos, lemmas, preds, preds_idx,
-         labels, labels_mask, stags, seq_lengths) = batch
+         labels, labels_mask, stags, seq_lengths, elmo_idx) = batch
         feed_dict = {
             self.elmo_placeholder: elmo,
             self.words_placeholder: words,
@@ -312,7 +465,8 @@ class SRL_Model(object):
             self.labels_placeholder: labels,
             self.labels_mask_placeholder: labels_mask,
             self.stags_placeholder: stags,
-            self.seq_lengths_placeholder: seq_lengths
+            self.seq_lengths_placeholder: seq_lengths,
+            self.elmo_idx_placeholder: elmo_idx
         }
         return feed_dict
         
@@ -359,33 +513,138 @@ class SRL_Model(object):
         return loss, probabilities
     
 
+    def get_batches(self, vocabs, corpus, plan, train):
+        """
+        The batch for each list of instances in `plan`: all made up front,
+        or with --prefetch_depth made in a background thread while the model
+        runs on earlier ones (and then made again for every epoch).
+        """
+        depth = getattr(self.args, 'prefetch_depth', 0)
+        batches = ((sents, make_batch_from_corpus(corpus, sents, vocabs, train))
+                   for sents in plan)
+        if depth > 0:
+            return Prefetcher(batches, depth)
+        return list(batches)
+
+
+    def load_elmo_cache(self, fn_txt, corpus=None):
+        """
+        With --elmo_cache, the precomputed ELMo vectors for a text file
+        (checked against its corpus if given), otherwise None
+        """
+        if not getattr(self.args, 'elmo_cache', False):
+            return None
+        elmo_cache = get_elmo_cache(fn_txt, layers.get_elmo_module(
+            getattr(self.args, 'elmo_module', None)))
+        if elmo_cache is None:
+            raise ValueError('No ELMo cache for {} (see '
+                             'model/elmo_features.py)'.format(fn_txt))
+        if corpus is not None:
+            elmo_cache.check(corpus)
+        return elmo_cache
+
+
+    def get_store_epoch(self, session, vocabs, fn_txt, fn_preds, fn_stags,
+                        language):
+        """
+        With --batch_store, the training batches are read from a store on
+        disk (built on first use, and shared by every run with the same
+        data and batching options, see util/batch_store.py) in a new
+        seeded order every epoch. Returns the batches and how many there are.
+        """
+        if self.training_store is None:
+            self.training_store = get_batch_store(
+                fn_txt, fn_preds, fn_stags, vocabs, language,
+                self.args.batch_size,
+                bucket_width=getattr(self.args, 'bucket_width', 0),
+                max_tokens=getattr(self.args, 'max_tokens', 0),
+                use_cache=getattr(self.args, 'use_cache', False),
+                num_workers=getattr(self.args, 'num_workers', 1),
+                by_sentence=self.by_sentence)
+            self.training_stats = self.training_store.padding_stats()
+            print('Loaded {} training batches from {}'.format(
+                len(self.training_store), self.training_store.store_dir))
+        rng = np.random.RandomState(
+            [getattr(self.args, 'seed', 89), self.training_epoch])
+        self.training_epoch += 1
+        if self.training_elmo_cache is None:
+            self.training_elmo_cache = self.load_elmo_cache(fn_txt)
+        epoch = self.training_store.epoch(rng, self.training_elmo_cache)
+        depth = getattr(self.args, 'prefetch_depth', 0)
+        if self.input_iterator is not None:
+            batches = self.dataset_batches(session, None,
+                                           list(epoch.instances()), True,
+                                           epoch)
+        elif depth > 0:
+            batches = Prefetcher(iter(epoch), depth)
+        else:
+            batches = epoch
+        return batches, len(epoch)
+
+
     def run_training_epoch(self, session, vocabs, fn_txt, fn_preds, fn_stags,
                            language):
         batch_size = self.args.batch_size
         total_loss = 0
         num_batches = 0
 
-        if self.training_batches is None:
-            print('Loading training batches...')
-            self.training_batches = [batch for batch in batch_producer(
-                batch_size, vocabs, fn_txt, fn_preds, fn_stags,
-                language, train=True)]
-            print('Loaded {} training batches'.format(
-                len(self.training_batches)))
-        total_batches = len(self.training_batches)
+        if getattr(self.args, 'batch_store', False):
+            batches, total_batches = self.get_store_epoch(
+                session, vocabs, fn_txt, fn_preds, fn_stags, language)
+        else:
+            if self.training_corpus is None:
+                print('Loading training data...')
+                self.training_corpus = load_corpus(
+                    fn_txt, fn_preds, fn_stags, vocabs, language,
+                    use_cache=getattr(self.args, 'use_cache', False),
+                    num_workers=getattr(self.args, 'num_workers', 1))
+                self.training_corpus.elmo_cache = self.load_elmo_cache(
+                    fn_txt, self.training_corpus)
+
+            # Batches in corpus order are made once; length buckets are
+            # reshuffled (reproducibly) every epoch
+            bucket_width = getattr(self.args, 'bucket_width', 0)
+            if self.training_plan is None or bucket_width > 0:
+                rng = np.random.RandomState(
+                    [getattr(self.args, 'seed', 89), self.training_epoch])
+                self.training_stats = PaddingStats()
+                self.training_plan = corpus_batch_plan(
+                    batch_size, self.training_corpus, train=True,
+                    bucket_width=bucket_width, rng=rng,
+                    stats=self.training_stats,
+                    max_tokens=getattr(self.args, 'max_tokens', 0),
+                    by_sentence=self.by_sentence)
+                self.training_batches = None
+                print('Loaded {} training batches'.format(
+                    len(self.training_plan)))
+            self.training_epoch += 1
+            total_batches = len(self.training_plan)
+            batches = self.training_batches
+            if self.input_iterator is not None:
+                batches = self.dataset_batches(
+                    session, self.training_corpus, self.training_plan, True,
+                    batches)
+            elif batches is None:
+                batches = self.get_batches(vocabs, self.training_corpus,
+                                           self.training_plan, train=True)
+                if not isinstance(batches, Prefetcher):
+                    self.training_batches = batches
         
-        for i, (_, batch) in enumerate(self.training_batches):
+        for i, (sents, batch) in enumerate(batches):
             loss = self.run_training_batch(session, batch)
             total_loss += loss
             num_batches += 1
             if i % 10 == 0:
                 avg_loss = total_loss / num_batches
-                batch_size = len(batch[0][1])
+                batch_size = len(sents)
                 msg = '\r{}/{}    loss: {}    batch_size: {}'.format(
                     i, total_batches, avg_loss, batch_size)
                 sys.stdout.write(msg)
                 sys.stdout.flush()
         print('\n')
+        print('Padding:', self.training_stats)
+        if isinstance(batches, Prefetcher):
+            print('Prefetching:', batches)
 
         return total_loss / num_batches
 
@@ -396,43 +655,60 @@ class SRL_Model(object):
         total_loss = 0
         num_batches = 0
 
-        if self.testing_batches is None:
+        if self.testing_plan is None:
             print('Loading testing batches...')
-            self.testing_batches = [batch for batch in batch_producer(
-                batch_size, vocabs, fn_txt, fn_preds, fn_stags,
-                language, train=False)]
-            print('Loaded {} testing batches.'.format(
-                len(self.testing_batches)))
-        total_batches = len(self.testing_batches)
-        
-        predicted_sents = []
-        for i, (sents, batch) in enumerate(self.testing_batches):
-            batch_loss, probabilities = self.run_testing_batch(session, batch)
-            total_loss += batch_loss
-            num_batches += 1
-
-            # Add the predictions to the sentence objects for later evaluation
-            for sent, probs in zip(sents, probabilities):
-                sent.add_predictions(probs, vocabs['labels'],
-                                     restrict_labels=self.args.restrict_labels)
-                # (sent.parent is the complete sentence, as opposed to the
-                # predicate-specific sentence)
-                if sent.parent not in predicted_sents:
-                    predicted_sents.append(sent.parent)
-            
-            if i % 10 == 0:
-                avg_loss = total_loss / num_batches
-                msg = '\r{}/{}    loss: {}'.format(
-                    i, total_batches, avg_loss)
-                sys.stdout.write(msg)
-                sys.stdout.flush()
+            self.testing_corpus = load_corpus(
+                fn_txt, fn_preds, fn_stags, vocabs, language,
+                use_cache=getattr(self.args, 'use_cache', False),
+                num_workers=getattr(self.args, 'num_workers', 1))
+            self.testing_corpus.elmo_cache = self.load_elmo_cache(
+                fn_txt, self.testing_corpus)
+            self.testing_stats = PaddingStats()
+            self.testing_plan = corpus_batch_plan(
+                batch_size, self.testing_corpus, train=False,
+                bucket_width=getattr(self.args, 'bucket_width', 0),
+                stats=self.testing_stats,
+                max_tokens=getattr(self.args, 'max_tokens', 0),
+                by_sentence=self.by_sentence)
+            print('Loaded {} testing batches ({})'.format(
+                len(self.testing_plan), self.testing_stats))
+        total_batches = len(self.testing_plan)
+        batches = self.testing_batches
+        if self.input_iterator is not None:
+            batches = self.dataset_batches(session, self.testing_corpus,
+                                           self.testing_plan, False, batches)
+        elif batches is None:
+            batches = self.get_batches(vocabs, self.testing_corpus,
+                                       self.testing_plan, train=False)
+            if not isinstance(batches, Prefetcher):
+                self.testing_batches = batches
+
+        # Predictions are written to a file for evaluation as each sentence
+        # is finished
+        with PredictionWriter(self.testing_corpus, fn_sys) as writer:
+            for i, (sents, batch) in enumerate(batches):
+                batch_loss, probabilities = self.run_testing_batch(session,
+                                                                   batch)
+                total_loss += batch_loss
+                num_batches += 1
+
+                for sent, probs in zip(sents, probabilities):
+                    sent.add_predictions(
+                        probs, vocabs['labels'],
+                        restrict_labels=self.args.restrict_labels)
+                writer.add(sents)
+
+                if i % 10 == 0:
+                    avg_loss = total_loss / num_batches
+                    msg = '\r{}/{}    loss: {}'.format(
+                        i, total_batches, avg_loss)
+                    sys.stdout.write(msg)
+                    sys.stdout.flush()
         print('\n')
+        if isinstance(batches, Prefetcher):
+            print('Prefetching:', batches)
         self.test_batches = num_batches
-
-        # Write the predictions to a file for evaluation
-        with open(fn_sys, 'w') as f:
-            for sent in predicted_sents:
-                f.write(str(sent) + '\n')
         print('Wrote predictions to', fn_sys)
-    
-        return total_loss / num_batches    
+
+        ## (A split with no predicates at all has no batches)
+        return total_loss / max(num_batches, 1)    
@@ -9,7 +9,9 @@ import numpy as np
 import tensorflow as tf
 
 from model import layers, lstm, stags
-from util.data_loader import batch_producer
+from util.data_loader import batch_producer, corpus_batch_producer
+from util.data_loader import load_corpus
+from util.corpus import PredictionWriter
 from tensorflow.python.client import timeline
 from timeit import default_timer as timer
 
@@ -25,7 +27,6 @@ class Redirect(object):
 class SRL_Model_Ens(object):
     def __init__(self, vocabs, args):
         self.args = args
-        batch_size = args.batch_size
 
         # Input placeholders
         ## Inputs are shaped (batch_size, seq_length) unless the input
@@ -39,18 +40,20 @@ class SRL_Model_Ens(object):
         ## labels_mask: mask invalid arg labels (given the predicate)
         ## stags_placeholder: a UD supertag for each word
         ## use_dropout_placeholder: 0.0 or 1.0, whether or not to use dropout
-        words_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        freqs_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        pos_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        lemmas_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-        preds_placeholder = tf.placeholder(tf.int32, shape=(batch_size,))
-        preds_idx_placeholder = tf.placeholder(tf.int32, shape=(batch_size,))
-        labels_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
+        words_placeholder = tf.placeholder(tf.int32, shape=(None, None))
+        freqs_placeholder = tf.placeholder(tf.int32, shape=(None, None))
+        pos_placeholder = tf.placeholder(tf.int32, shape=(None, None))
+        lemmas_placeholder = tf.placeholder(tf.int32, shape=(None, None))
+        preds_placeholder = tf.placeholder(tf.int32, shape=(None,))
+        preds_idx_placeholder = tf.placeholder(tf.int32, shape=(None,))
+        labels_placeholder = tf.placeholder(tf.int32, shape=(None, None))
         labels_mask_placeholder = tf.placeholder(
-            tf.float32, shape=(batch_size, vocabs['labels'].size))
-        stags_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
+            tf.float32, shape=(None, vocabs['labels'].size))
+        stags_placeholder = tf.placeholder(tf.int32, shape=(None, None))
         use_dropout_placeholder = tf.placeholder(tf.float32, shape=())
-        seq_lengths_placeholder = tf.placeholder(tf.int32, shape=(batch_size,))
+        seq_lengths_placeholder = tf.placeholder(tf.int32, shape=(None,))
+        ## The last batch of an epoch can be smaller than args.batch_size
+        batch_size = tf.shape(words_placeholder)[0]
 
         # Word representation
 
@@ -156,7 +159,7 @@ class SRL_Model_Ens(object):
                     cell=cell,
                     input_size=input_size,
                     state_size=args.state_size,
-                    batch_size=args.batch_size,
+                    batch_size=batch_size,
                     num_layers=args.num_layers,
                     dropout=dropout,
                     recurrent_dropout=recurrent_dropout)
@@ -297,11 +300,13 @@ class SRL_Model_Ens(object):
 
         self.training_batches = None
         self.testing_batches = None
+        self.testing_corpus = None
 
 
     def batch_to_feed(self, batch):
-        (words, freqs, pos, lemmas, preds, preds_idx,
-         labels, labels_mask, stags, seq_lengths) = batch
+        ## (The ensemble doesn't use ELMo)
+        (_, words, freqs, pos, lemmas, preds, preds_idx,
+         labels, labels_mask, stags, seq_lengths, _) = batch
         feed_dict = {
             self.words_placeholder: words,
             self.freqs_placeholder: freqs,
@@ -374,13 +379,13 @@ class SRL_Model_Ens(object):
                 len(self.training_batches)))
         total_batches = len(self.training_batches)
         
-        for i, (_, batch) in enumerate(self.training_batches):
+        for i, (sents, batch) in enumerate(self.training_batches):
             loss = self.run_training_batch(session, batch)
             total_loss += loss
             num_batches += 1
             if i % 10 == 0:
                 avg_loss = total_loss / num_batches
-                batch_size = len(batch[0][1])
+                batch_size = len(sents)
                 msg = '\r{}/{}    loss: {}    batch_size: {}'.format(
                     i, total_batches, avg_loss, batch_size)
                 sys.stdout.write(msg)
@@ -398,41 +403,38 @@ class SRL_Model_Ens(object):
 
         if self.testing_batches is None:
             print('Loading testing batches...')
-            self.testing_batches = [batch for batch in batch_producer(
-                batch_size, vocabs, fn_txt, fn_preds, fn_stags,
-                language, train=False)]
+            self.testing_corpus = load_corpus(
+                fn_txt, fn_preds, fn_stags, vocabs, language)
+            self.testing_batches = [batch for batch in corpus_batch_producer(
+                batch_size, vocabs, self.testing_corpus, train=False)]
             print('Loaded {} testing batches.'.format(
                 len(self.testing_batches)))
         total_batches = len(self.testing_batches)
-        
-        predicted_sents = []
-        for i, (sents, batch) in enumerate(self.testing_batches):
-            batch_loss, probabilities = self.run_testing_batch(session, batch)
-            total_loss += batch_loss
-            num_batches += 1
 
-            # Add the predictions to the sentence objects for later evaluation
-            for sent, probs in zip(sents, probabilities):
-                sent.add_predictions(probs, vocabs['labels'],
-                                     restrict_labels=self.args.restrict_labels)
-                # (sent.parent is the complete sentence, as opposed to the
-                # predicate-specific sentence)
-                if sent.parent not in predicted_sents:
-                    predicted_sents.append(sent.parent)
-            
-            if i % 10 == 0:
-                avg_loss = total_loss / num_batches
-                msg = '\r{}/{}    loss: {}'.format(
-                    i, total_batches, avg_loss)
-                sys.stdout.write(msg)
-                sys.stdout.flush()
+        # Predictions are written to a file for evaluation as each sentence
+        # is finished
+        with PredictionWriter(self.testing_corpus, fn_sys) as writer:
+            for i, (sents, batch) in enumerate(self.testing_batches):
+                batch_loss, probabilities = self.run_testing_batch(session,
+                                                                   batch)
+                total_loss += batch_loss
+                num_batches += 1
+
+                for sent, probs in zip(sents, probabilities):
+                    sent.add_predictions(
+                        probs, vocabs['labels'],
+                        restrict_labels=self.args.restrict_labels)
+                writer.add(sents)
+
+                if i % 10 == 0:
+                    avg_loss = total_loss / num_batches
+                    msg = '\r{}/{}    loss: {}'.format(
+                        i, total_batches, avg_loss)
+                    sys.stdout.write(msg)
+                    sys.stdout.flush()
         print('\n')
         self.test_batches = num_batches
-
-        # Write the predictions to a file for evaluation
-        with open(fn_sys, 'w') as f:
-            for sent in predicted_sents:
-                f.write(str(sent) + '\n')
         print('Wrote predictions to', fn_sys)
-    
-        return total_loss / num_batches    
+
+        ## (A split with no predicates at all has no batches)
+        return total_loss / max(num_batches, 1)    
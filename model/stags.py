@@ -54,7 +54,7 @@ def get_model1_embeddings(language, vocab, embed_size):
     # Each row maps a supertag to a head_rel/binary feature vector
     head_rels = np.zeros((vocab.size,), dtype=np.int32)
     bin_feats = np.zeros((vocab.size, 4), dtype=np.int32)
-    for idx, stag in vocab.idx_to_word.iteritems():
+    for idx, stag in enumerate(vocab.words.tolist()):
         if stag in stag_to_str:
             head_rel, bin_feat = str_to_feats(stag_to_str[stag])
             head_rels[idx] = head_rel
@@ -9,6 +9,7 @@ import numpy as np
 import pickle
 
 from srl import SRL_Model
+from elmo_features import precompute_elmo
 from eval.eval import run_evaluation_script
 from util import vocab
 
@@ -22,6 +23,27 @@ parser.add_argument("-rl", "--restrict_labels", dest="restrict_labels",
                     action="store_true", default=False)
 
 parser.add_argument("--stags", help="Only allow valid labels", default=None)
+parser.add_argument("--use_cache",
+                    help="Read data from a compiled binary corpus cache",
+                    action="store_true", default=False)
+parser.add_argument("--num_workers",
+                    help="Number of processes for parsing the data files",
+                    type=int, default=1)
+parser.add_argument("--prefetch_depth",
+                    help="Make up to this many batches ahead in a background "
+                         "thread while the model runs",
+                    type=int, default=0)
+parser.add_argument("--use_dataset",
+                    help="Feed batches to the model through a tf.data "
+                         "pipeline instead of feed_dict",
+                    action="store_true", default=False)
+parser.add_argument("--input_threads",
+                    help="Number of threads making batches for --use_dataset",
+                    type=int, default=2)
+parser.add_argument("--elmo_module",
+                    help="Local directory (or URL) of the ELMo module, if "
+                         "not the one the model was trained with",
+                    default=None)
 
 def test(args):
     model_dir = args.model_dir    
@@ -29,6 +51,13 @@ def test(args):
         model_args = pickle.load(f)
     if not hasattr(model_args, 'language'):
         model_args.language = 'eng'
+    model_args.use_cache = args.use_cache
+    model_args.num_workers = args.num_workers
+    model_args.prefetch_depth = args.prefetch_depth
+    model_args.use_dataset = args.use_dataset
+    model_args.input_threads = args.input_threads
+    if args.elmo_module is not None:
+        model_args.elmo_module = args.elmo_module
 
     #model_args.stags_dir = 'pred'
         
@@ -47,6 +76,9 @@ def test(args):
     fn_sys = os.path.join(args.model_dir, fn_sys)
     
     vocabs = vocab.get_vocabs(model_args.language, model_args.stag_type)
+    if getattr(model_args, 'elmo_cache', False):
+        precompute_elmo(fn_txt_valid, model_args.language,
+                        module=getattr(model_args, 'elmo_module', None))
 
     with tf.Graph().as_default():
         tf.set_random_seed(model_args.seed)
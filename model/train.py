@@ -9,6 +9,7 @@ import tensorflow as tf
 import numpy as np
 #import cPickle as pickle
 from srl import SRL_Model
+from elmo_features import precompute_elmo
 import pickle
 from timeit import default_timer as timer
 
@@ -43,6 +44,12 @@ parser.add_argument("--batch_size",
 parser.add_argument("--num_layers",
                     help="Number of layers in the BiLSTM",
                     default=4, type=int)
+parser.add_argument("--sentence_layers",
+                    help="Number of lower BiLSTM layers that run once per "
+                         "sentence, shared by all of its predicates (the "
+                         "predicate marker is only added above them). "
+                         "0 runs every layer once per predicate",
+                    default=0, type=int)
 parser.add_argument("--dropout",
                     help="Dropout keep probability (between LSTM layers)",
                     default=1.0, type=float)
@@ -109,6 +116,48 @@ parser.add_argument("--alpha",
 parser.add_argument("--optimizer",
                     help="Choice of optimizer",
                     choices=['adam', 'adadelta'], default='adam')
+parser.add_argument("--use_cache",
+                    help="Read data from a compiled binary corpus cache",
+                    action="store_true", default=False)
+parser.add_argument("--bucket_width",
+                    help="Batch predicates with sentences of similar length "
+                         "(lengths within this many tokens), reshuffled "
+                         "every epoch. 0 batches in corpus order",
+                    type=int, default=0)
+parser.add_argument("--max_tokens",
+                    help="Size batches to hold at most this many (padded) "
+                         "tokens instead of --batch_size instances. "
+                         "0 uses --batch_size",
+                    type=int, default=0)
+parser.add_argument("--num_workers",
+                    help="Number of processes for parsing the data files",
+                    type=int, default=1)
+parser.add_argument("--prefetch_depth",
+                    help="Make up to this many batches ahead in a background "
+                         "thread while the model runs. 0 makes them all "
+                         "up front",
+                    type=int, default=0)
+parser.add_argument("--use_dataset",
+                    help="Feed batches to the model through a tf.data "
+                         "pipeline instead of feed_dict",
+                    action="store_true", default=False)
+parser.add_argument("--input_threads",
+                    help="Number of threads making batches for --use_dataset",
+                    type=int, default=2)
+parser.add_argument("--batch_store",
+                    help="Read training batches from a store on disk, built "
+                         "once and shared by runs with the same data and "
+                         "batching options, in a new order every epoch",
+                    action="store_true", default=False)
+parser.add_argument("--elmo_cache",
+                    help="Precompute ELMo features for each split once and "
+                         "read them from disk instead of running the ELMo "
+                         "module in the model",
+                    action="store_true", default=False)
+parser.add_argument("--elmo_module",
+                    help="Local directory (or URL) of the ELMo module. "
+                         "Defaults to $ELMO_MODULE, then tfhub.dev",
+                    default=None)
 parser.add_argument("--debug",
                     help="Use a smaller configuration for debugging",
                     action="store_true", default=False)
@@ -122,6 +171,7 @@ class Debug_Args(object):
         self.state_size = 32
         self.batch_size = 10
         self.num_layers = 2
+        self.sentence_layers = 0
         self.dropout = 0.7
         self.recurrent_dropout = 0.9
         self.learning_rate = 0.01
@@ -146,6 +196,16 @@ class Debug_Args(object):
         self.use_highway_lstm = True
         self.optimizer = 'adam'
         self.language = 'eng'
+        self.use_cache = False
+        self.num_workers = 1
+        self.bucket_width = 0
+        self.max_tokens = 0
+        self.prefetch_depth = 0
+        self.use_dataset = False
+        self.input_threads = 2
+        self.batch_store = False
+        self.elmo_cache = False
+        self.elmo_module = None
     
 
 def train(args):
@@ -232,6 +292,11 @@ def train(args):
         pickle.dump(args, f)
 
     vocabs = vocab.get_vocabs(args.language, args.stag_type)
+    if args.elmo_cache:
+        precompute_elmo(fn_txt_train, args.language,
+                        module=args.elmo_module)
+        precompute_elmo(fn_txt_valid, args.language,
+                        module=args.elmo_module)
 
     with tf.Graph().as_default():
         tf.set_random_seed(args.seed)
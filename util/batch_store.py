@@ -0,0 +1,295 @@
+# batch_store.py
+# Disk-backed store of the padded training batches of a dataset, so they
+# are built once and then memory-mapped by every run with the same data,
+# vocabs and batching options (e.g. all the runs of a hyperparameter sweep)
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import numpy as np
+
+from util.corpus_cache import get_cache_meta, cache_is_fresh
+from util.data_loader import load_corpus, corpus_batch_plan
+from util.data_loader import make_corpus_batch, TokenGrid, PaddingStats
+from util.files import get_cache_dir
+from util.vocab import get_vocabs
+
+# Bump this whenever the layout of the store changes
+STORE_VERSION = 3
+
+## Batches per shard. Shards are contiguous on disk, so an epoch visits the
+## shards in random order and the batches of each shard in random order
+SHARD_SIZE = 64
+
+# Arrays of a batch (see make_batch) as stored: sequence fields are
+# (batch_size, seq_length), the others have one value per instance.
+# ELMo strings are stored as codes into the store's string table, for each
+# instance (the distinct sentences are picked out when a batch is read).
+SEQ_FIELDS = ['forms', 'words', 'freqs', 'pos', 'lemmas', 'labels', 'stags']
+SINGLE_FIELDS = ['preds', 'preds_idx', 'seq_lengths', 'elmo_idx',
+                 'instances', 'sent_idxs']
+
+
+def get_store_meta(fn_txt, fn_preds, fn_stags, vocabs, language, batch_size,
+                   bucket_width=0, max_tokens=0, by_sentence=False):
+    meta = get_cache_meta(fn_txt, fn_preds, fn_stags, vocabs, language)
+    meta['store_version'] = STORE_VERSION
+    meta['batch_size'] = batch_size
+    meta['bucket_width'] = bucket_width
+    meta['max_tokens'] = max_tokens
+    meta['by_sentence'] = by_sentence
+    return meta
+
+
+def get_store_dir(fn_txt, fn_preds, fn_stags, meta):
+    """A store per set of options, next to the corpus cache of the files"""
+    key = hashlib.md5(json.dumps(meta, sort_keys=True).encode('utf-8'))
+    return '{}.batches.{}'.format(get_cache_dir(fn_txt, fn_preds, fn_stags),
+                                  key.hexdigest()[:12])
+
+
+def build_batch_store(corpus, plan, vocabs, store_dir, meta):
+    """
+    Writes the batch for each list of CorpusPred instances in `plan` (from
+    an encoded Corpus) to `store_dir`: one .npy file per field, holding
+    the arrays of every batch one after the other, plus an index of batch
+    shapes. Batches are written straight into memory-mapped files, so the
+    whole set is never in memory at once.
+    """
+    sent_lengths = np.diff(corpus.sent_offsets)
+    ## batch_size, seq_length, and how many distinct instances there are
+    ## (all of them, now that batches aren't filled out with repeats)
+    index = np.zeros((len(plan), 3), dtype=np.int64)
+    for i, sents in enumerate(plan):
+        index[i, 0] = len(sents)
+        index[i, 1] = sent_lengths[[sent.sent_idx for sent in sents]].max()
+        index[i, 2] = len(set((sent.sent_idx, sent.pred_num)
+                              for sent in sents))
+    num_rows = int(index[:, 0].sum())
+    num_tokens = int((index[:, 0] * index[:, 1]).sum())
+    num_labels = vocabs['labels'].size
+
+    ## Each run writes its own temporary directory, so runs of a sweep
+    ## that start at the same time don't clobber each other
+    tmp_dir = '{}.tmp{}'.format(store_dir.rstrip('/'), os.getpid())
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    def open_array(name, dtype, shape):
+        return np.lib.format.open_memmap(
+            os.path.join(tmp_dir, name + '.npy'), mode='w+', dtype=dtype,
+            shape=shape)
+    arrays = {name: open_array(name, np.int32, (num_tokens,))
+              for name in SEQ_FIELDS}
+    arrays.update({name: open_array(name, np.int32, (num_rows,))
+                   for name in SINGLE_FIELDS})
+    arrays['labels_mask'] = open_array('labels_mask', np.uint8,
+                                       (num_rows, num_labels))
+
+    token_pos, row_pos = 0, 0
+    for sents, (size, length, _) in zip(plan, index):
+        (_, words, freqs, pos, lemmas, preds, preds_idx, labels, labels_mask,
+         stags, seq_lengths, elmo_idx) = make_corpus_batch(corpus, sents,
+                                                           vocabs)
+        sent_idxs = np.array([sent.sent_idx for sent in sents])
+        grid = TokenGrid(corpus, sent_idxs)
+        forms = np.where(grid.pad_mask, corpus.forms[grid.token_idxs], -1)
+        instances = [corpus.pred_offsets[sent.sent_idx] + sent.pred_num
+                     for sent in sents]
+        seqs = [forms, words, freqs, pos, lemmas, labels, stags]
+        for name, data in zip(SEQ_FIELDS, seqs):
+            arrays[name][token_pos:token_pos + size * length] = data.ravel()
+        singles = [preds, preds_idx, seq_lengths, elmo_idx, instances,
+                   sent_idxs]
+        for name, data in zip(SINGLE_FIELDS, singles):
+            arrays[name][row_pos:row_pos + size] = data
+        arrays['labels_mask'][row_pos:row_pos + size] = labels_mask
+        token_pos += size * length
+        row_pos += size
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    np.save(os.path.join(tmp_dir, 'index.npy'), index)
+    ## Same string table format as the corpus cache
+    strings = '\n'.join(corpus.strings).encode('utf-8')
+    np.save(os.path.join(tmp_dir, 'strings.npy'),
+            np.frombuffer(strings, dtype=np.uint8))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir, ignore_errors=True)
+    try:
+        os.rename(tmp_dir, store_dir)
+    except OSError:
+        ## Another run finished the same store first
+        shutil.rmtree(tmp_dir)
+
+
+class BatchStore(object):
+    """
+    The batches in a store directory, memory-mapped (see build_batch_store).
+      store[i]              batch i as (instances, batch), like
+                              corpus_batch_producer: `instances` are the
+                              predicate ids (into the Corpus) of its rows
+      store.epoch(rng)      all of the batches in a shuffled order
+      store.padding_stats() a PaddingStats for the whole store
+    With an ElmoCache, batches hold ELMo vectors instead of ELMo tokens.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index = self.load('index')
+        self.arrays = {name: self.load(name) for name in
+                       SEQ_FIELDS + SINGLE_FIELDS + ['labels_mask']}
+        strings = self.load('strings').tobytes().decode('utf-8').split('\n')
+        self.strings = np.array(strings, dtype=object)
+        sizes = self.index[:, 0]
+        self.row_offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self.token_offsets = np.concatenate(
+            [[0], np.cumsum(sizes * self.index[:, 1])])
+
+    def load(self, name):
+        return np.load(os.path.join(self.store_dir, name + '.npy'),
+                       mmap_mode='r')
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.batch(i)
+
+    def batch(self, i, rows=None, elmo_cache=None):
+        """Batch i, with its rows in the order `rows` if given"""
+        size, length, _ = self.index[i]
+        t0, t1 = self.token_offsets[i], self.token_offsets[i + 1]
+        r0, r1 = self.row_offsets[i], self.row_offsets[i + 1]
+        if rows is None:
+            rows = np.arange(size)
+
+        def seq(name):
+            return self.arrays[name][t0:t1].reshape((size, length))[rows]
+
+        def single(name):
+            return self.arrays[name][r0:r1][rows]
+
+        ## The first row of each distinct sentence
+        elmo_idx = single('elmo_idx')
+        _, first = np.unique(elmo_idx, return_index=True)
+        if elmo_cache is not None:
+            elmo = elmo_cache.gather(single('sent_idxs')[first], length)
+        else:
+            forms = seq('forms')[first]
+            pad_mask = forms != -1
+            elmo = np.zeros(forms.shape).astype(str)
+            elmo[pad_mask] = self.strings[forms[pad_mask]]
+        labels_mask = self.arrays['labels_mask'][r0:r1][rows].astype(
+            np.float32)
+        batch = (elmo, seq('words'), seq('freqs'), seq('pos'), seq('lemmas'),
+                 single('preds'), single('preds_idx'), seq('labels'),
+                 labels_mask, seq('stags'), single('seq_lengths'), elmo_idx)
+        return single('instances'), batch
+
+    def epoch(self, rng=None, elmo_cache=None):
+        """
+        The batches for one epoch, as a StoreEpoch: with an rng, shards are
+        visited in a random order, the batches of each shard in a random
+        order, and the rows of each batch are shuffled too.
+        """
+        if rng is None:
+            return StoreEpoch(self, np.arange(len(self)), None, elmo_cache)
+        shards = np.arange(0, len(self), SHARD_SIZE)
+        order = [start + rng.permutation(min(SHARD_SIZE, len(self) - start))
+                 for start in shards[rng.permutation(len(shards))]]
+        order = np.concatenate(order + [np.zeros(0, dtype=np.int64)])
+        rows = [rng.permutation(self.index[i, 0]) for i in order]
+        return StoreEpoch(self, order, rows, elmo_cache)
+
+    def padding_stats(self):
+        stats = PaddingStats()
+        seq_lengths = self.arrays['seq_lengths']
+        for i, (size, _, num_real) in enumerate(self.index):
+            r0 = self.row_offsets[i]
+            stats.add(seq_lengths[r0:r0 + num_real], size)
+        return stats
+
+
+class StoreEpoch(object):
+    """
+    A list of (instances, batch) pairs in the order of one epoch, read from
+    a BatchStore as they are used
+    """
+    def __init__(self, store, order, rows, elmo_cache=None):
+        self.store = store
+        self.order = order
+        self.rows = rows
+        self.elmo_cache = elmo_cache
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        rows = None if self.rows is None else self.rows[i]
+        return self.store.batch(self.order[i], rows, self.elmo_cache)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def instances(self):
+        """The instances of each batch, without reading the batches"""
+        store = self.store
+        for i, batch_num in enumerate(self.order):
+            r0 = store.row_offsets[batch_num]
+            instances = store.arrays['instances'][
+                r0:store.row_offsets[batch_num + 1]]
+            yield instances if self.rows is None else instances[self.rows[i]]
+
+
+def get_batch_store(fn_txt, fn_preds, fn_stags, vocabs, language, batch_size,
+                    bucket_width=0, max_tokens=0, use_cache=False,
+                    num_workers=1, by_sentence=False):
+    """
+    The BatchStore of the training batches for the given files and options,
+    building it first if there is none yet or if the data files or vocabs
+    have changed. With bucket_width, the buckets are drawn once (with a
+    fixed seed) when the store is built; epochs then shuffle the batches.
+    See corpus_batch_plan for by_sentence.
+    """
+    meta = get_store_meta(fn_txt, fn_preds, fn_stags, vocabs, language,
+                          batch_size, bucket_width, max_tokens,
+                          by_sentence)
+    store_dir = get_store_dir(fn_txt, fn_preds, fn_stags, meta)
+    if not cache_is_fresh(store_dir, meta):
+        print('Building batch store for {}...'.format(fn_txt))
+        corpus = load_corpus(fn_txt, fn_preds, fn_stags, vocabs, language,
+                             use_cache, num_workers)
+        rng = np.random.RandomState(0) if bucket_width > 0 else None
+        plan = corpus_batch_plan(batch_size, corpus, train=True,
+                                 bucket_width=bucket_width, rng=rng,
+                                 max_tokens=max_tokens,
+                                 by_sentence=by_sentence)
+        build_batch_store(corpus, plan, vocabs, store_dir, meta)
+    return BatchStore(store_dir)
+
+
+if __name__ == '__main__':
+    # Usage: python -m util.batch_store language stag_type batch_size
+    #          txt preds stags [bucket_width [max_tokens [by_sentence]]]
+    # Builds a store ahead of time (e.g. before starting a sweep)
+    language, stag_type = sys.argv[1:3]
+    batch_size = int(sys.argv[3])
+    fn_txt, fn_preds, fn_stags = sys.argv[4:7]
+    bucket_width = int(sys.argv[7]) if len(sys.argv) > 7 else 0
+    max_tokens = int(sys.argv[8]) if len(sys.argv) > 8 else 0
+    by_sentence = len(sys.argv) > 9 and sys.argv[9] not in ('0', 'False')
+    vocabs = get_vocabs(language, stag_type)
+    store = get_batch_store(fn_txt, fn_preds, fn_stags, vocabs, language,
+                            batch_size, bucket_width, max_tokens,
+                            by_sentence=by_sentence)
+    print('{} batches ({}) in {}'.format(len(store), store.padding_stats(),
+                                         store.store_dir))
@@ -5,6 +5,10 @@ import numpy as np
 import pickle
 #from itertools import zip
 
+from util.normalize import normalize, normalize_column
+from util.lookups import get_frames, get_lemma_table
+from util.files import open_file
+
 class CoNLL09_Pred_List(object):
     """
     Stores information about a predicate and its arguments.
@@ -45,7 +49,7 @@ class CoNLL09_Sent(object):
           preds: a list of the predicates (or '_' for non-predicates)
         """
         self.lines = [line[:13] for line in lines]
-        self.words = [self.normalize(line[1]) for line in lines]
+        self.words = normalize_column([line[1] for line in lines])
         self.elmo = [line[1] for line in lines]
         self.pos = [line[5] for line in lines]
         self.stags = [line[-1] for line in lines]
@@ -97,30 +101,7 @@ class CoNLL09_Sent(object):
         
 
     def normalize(self, token):
-        """From Marcheggiani et al"""
-        penn_tokens = {
-            '-LRB-': '(',
-            '-RRB-': ')',
-            '-LSB-': '[',
-            '-RSB-': ']',
-            '-LCB-': '{',
-            '-RCB-': '}' 
-        }
-        if token in penn_tokens:
-            return penn_tokens[token]
-
-        token = token.lower()
-        try:
-            int(token)
-            return "<NUM>"
-        except:
-            pass
-        try:
-            float(token.replace(',', ''))
-            return "<FLOAT>"
-        except:
-            pass
-        return token
+        return normalize(token)
    
         
     def __str__(self):
@@ -159,41 +140,93 @@ class CoNLL09_Sent_with_Pred(object):
     This is like a CoNLL09_Sent but encoded for a specific predicate.
     It has fields for words, pos, lemmas, stags, etc., and also a pointer
     to the parent CoNLL09_Sent.
+    It is only a view of (parent sentence, predicate number): every field
+    is read from the parent on access and predictions are written straight
+    to the parent, so a predicate instance costs three pointers no matter
+    how long the sentence is.
     """
-    def __init__(self, sent, pred_num, pred_to_frame):
-        self.words = sent.words
-        self.elmo = sent.elmo
-        self.pos = sent.pos
-        self.lemmas = sent.lemmas
-        self.stags = sent.stags
-        self.length = len(self.words)
-        self.frame = []
+    __slots__ = ['parent', 'pred_num', 'pred_to_frame']
 
+    def __init__(self, sent, pred_num, pred_to_frame):
         # pred_num == -1 means that this is a dummy object for a sentence
         # with no predicates
-        if pred_num != -1:
-            pred_list = sent.pred_lists[pred_num]
-            self.pred = pred_list.pred_lemma
-            self.full_pred = pred_list.full_pred
-            self.pred_idx = pred_list.pred_idx
-            self.labels = pred_list.arg_seq
-            if self.pred in pred_to_frame:
-                self.frame = pred_to_frame[self.pred]
-            self.count = len([l for l in self.labels if l not in self.frame])
-        else:
-            self.count = 0
-            pred_list = []
-            self.pred = None
-            self.pred_idx = 0
-            self.labels = []
-            
-        self.predictions = []
-        self.pred_num = pred_num
         self.parent = sent
+        self.pred_num = pred_num
+        self.pred_to_frame = pred_to_frame
+
+    @property
+    def words(self):
+        return self.parent.words
+
+    @property
+    def elmo(self):
+        return self.parent.elmo
+
+    @property
+    def pos(self):
+        return self.parent.pos
+
+    @property
+    def lemmas(self):
+        return self.parent.lemmas
+
+    @property
+    def stags(self):
+        return self.parent.stags
+
+    @property
+    def length(self):
+        return len(self.parent)
+
+    @property
+    def pred_list(self):
+        if self.pred_num == -1:
+            return None
+        return self.parent.pred_lists[self.pred_num]
+
+    @property
+    def pred(self):
+        if self.pred_num == -1:
+            return None
+        return self.pred_list.pred_lemma
+
+    @property
+    def full_pred(self):
+        return self.pred_list.full_pred
+
+    @property
+    def pred_idx(self):
+        if self.pred_num == -1:
+            return 0
+        return self.pred_list.pred_idx
+
+    @property
+    def labels(self):
+        if self.pred_num == -1:
+            return []
+        return self.pred_list.arg_seq
+
+    @property
+    def frame(self):
+        if self.pred_num == -1:
+            return []
+        return self.pred_to_frame.get(self.pred, [])
+
+    @property
+    def count(self):
+        """Number of gold labels that aren't in the predicate's frame"""
+        frame = self.frame
+        return len([l for l in self.labels if l not in frame])
+
+    @property
+    def predictions(self):
+        if self.pred_num == -1:
+            return []
+        return [row[self.pred_num] for row in self.parent.predictions_list]
 
 
     def __len__(self):
-        return len(self.words)
+        return len(self.parent)
 
 
     def add_predictions(self, probs, vocab, restrict_labels=False):
@@ -202,7 +235,7 @@ class CoNLL09_Sent_with_Pred(object):
           containing a probability distribution over labels for each
           word in the sequence
         add_predictions picks the most probable label for each
-          word and also adds the predictions to the parent sentence
+          word and adds the predictions to the parent sentence
           for writing to file later
         If restrict_labels is set to True then only labels from the predicate's
           frame are allowed (note that the predicate frame information is
@@ -211,56 +244,33 @@ class CoNLL09_Sent_with_Pred(object):
         if self.pred_num == -1:
             return
 
-        # Decode predictions
+        # Decode predictions (probs may be padded past the sentence length)
         raw_predictions = np.argmax(probs, axis=1)
-        predictions = [vocab.decode(p) for p in raw_predictions]
-        self.predictions = predictions
-
-        # Add the predictions to the parent's predictions list
-        for i, row in enumerate(self.parent.predictions_list):
-            row[self.pred_num] = predictions[i]
+        pred_num = self.pred_num
+        for row, p in zip(self.parent.predictions_list, raw_predictions):
+            row[pred_num] = vocab.decode(p)
 
 
 def get_pred_to_frame(language):
-    """Returns a dictionary mapping predicates to allowable frames"""
-    fn_in = 'data/{}/frames.txt'.format(language)
-    pred_to_frame = {}
-    with open(fn_in, 'r') as f:
-        for line in f:
-            parts = line.strip().split(' ')
-            if parts[0] in pred_to_frame:
-                pred_to_frame[parts[0]] = list(set(pred_to_frame[parts[0]] +
-                                                   parts[1:]))
-            else:
-                pred_to_frame[parts[0]] = parts[1:]
-    return pred_to_frame
+    """
+    Returns a mapping from predicates to allowable frames (a LookupTable,
+    compiled once and shared by everything in the process; see
+    util/lookups.py)
+    """
+    return get_frames(language)
 
 
 def get_lemma_to_preds(fn='data/eng/conll09/train.txt'):
     """
-    Given a file (default: English training set), returns a dictionary
-    mapping each lemma to the set of predicates that are associated with
-    that lemma in the dataset.
-    `d` is a dictionary mapping strings to sets.
+    Given a file (default: English training set), returns a mapping from
+    each lemma to the list of predicates that are associated with that
+    lemma in the dataset (a LookupTable; see util/lookups.py).
     """
-    d = {}
-    with open(fn, 'r') as f:
-        for line in f:
-            if line == '\n':
-                continue
-            parts = line.split('\t')
-            if parts[12] == 'Y':
-                lemma = parts[3]
-                predicate = parts[13]
-                if lemma not in d:
-                    d[lemma] = []
-                if predicate not in d[lemma]:
-                    d[lemma].append(predicate)
-    return d
+    return get_lemma_table(fn)
 
 
 def _get_lemma_to_preds(fn='data/eng/frames/lemma_to_preds.pkl'):
-    with open(fn, 'r') as f:
+    with open(fn, 'rb') as f:
         d = pickle.load(f)
     return d
     
@@ -272,7 +282,7 @@ def conll09_generator(fn_txt, fn_preds, fn_stags,
     Given a file object, yields CoNLL09_Sent_with_Pred objects.
     """
     pred_to_frame = get_pred_to_frame(language)
-    fs = [open(fn, 'r') for fn in [fn_txt, fn_preds, fn_stags]]
+    fs = [open_file(fn) for fn in [fn_txt, fn_preds, fn_stags]]
     lines = []
     for line, pred, stag in zip(*fs):
         if line == '\n':
@@ -0,0 +1,584 @@
+# corpus.py
+# Columnar storage for CoNLL-09 data: every field of every sentence is kept
+# in one flat numpy array, and sentences/predicates are lightweight views
+from __future__ import print_function
+from __future__ import division
+
+from array import array
+import numpy as np
+
+from util.conll_io import get_pred_to_frame
+from util.files import open_file
+from util.normalize import normalize_column
+
+# Token fields, stored as int32 codes into Corpus.strings:
+#   forms: raw word forms (used for ELMo)
+#   words: normalized word forms
+#   lemmas: predicate lemma for predicates (from the predicates file), else _
+#   preds: the predicates file column
+#   predicates: the (gold) PRED column of the CoNLL file
+TOKEN_FIELDS = ['forms', 'words', 'pos', 'lemmas', 'plemmas', 'predicates',
+                'preds', 'fill_preds', 'stags']
+
+# Offsets and predicate arrays. Sentence i covers tokens
+#   sent_offsets[i]:sent_offsets[i+1]
+# and predicates pred_offsets[i]:pred_offsets[i+1]. Predicate p is word
+# pred_idx[p] of its sentence and its argument labels (one per word in the
+# sentence, as codes) are args[arg_offsets[p]:arg_offsets[p]+length].
+# `rows` holds the utf-8 text of the first 13 CoNLL columns of each token,
+# with token t at rows[row_offsets[t]:row_offsets[t+1]].
+INDEX_ARRAYS = ['sent_offsets', 'pred_offsets', 'pred_idx', 'arg_offsets',
+                'args', 'rows', 'row_offsets']
+
+ARRAYS = TOKEN_FIELDS + INDEX_ARRAYS
+
+# Fields that Corpus.encode maps to ids with the vocab of the same name
+VOCAB_FIELDS = ['words', 'pos', 'lemmas', 'plemmas', 'stags', 'predicates']
+
+
+class Corpus(object):
+    """
+    A CoNLL-09 dataset stored column by column (see ARRAYS above).
+    Strings are interned: each distinct string is stored once in
+    `strings`, and the token fields hold int32 codes into it.
+    Once `encode` is called, `ids` holds the vocab ids of every field.
+    """
+    def __init__(self, arrays, strings, language='eng', ids=None):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.strings = strings
+        self.language = language
+        self.ids = ids if ids is not None else {}
+        self.pred_to_frame = get_pred_to_frame(language)
+        self._string_array = None
+        ## Precomputed ELMo vectors (an ElmoCache), if any
+        self.elmo_cache = None
+
+        self.num_sents = len(self.sent_offsets) - 1
+        self.num_preds = len(self.pred_idx)
+        ## Predicted labels, parallel to `args` (-1 means no prediction)
+        self.predictions = np.full(len(self.args), -1, dtype=np.int32)
+        self.prediction_vocab = None
+
+    def __len__(self):
+        return self.num_sents
+
+    def sent(self, i):
+        return CorpusSent(self, i)
+
+    def sents(self):
+        for i in range(self.num_sents):
+            yield CorpusSent(self, i)
+
+    def pred_instances(self, train=True):
+        """
+        Yields a CorpusPred for each predicate in the corpus.
+        When testing, sentences without predicates get a dummy instance
+        (pred_num == -1), like in conll09_generator. (Batches leave them
+        out: PredictionWriter writes those sentences without them.)
+        """
+        for i in range(self.num_sents):
+            num_preds = int(self.pred_offsets[i + 1] - self.pred_offsets[i])
+            for pred_num in range(num_preds):
+                yield CorpusPred(self, i, pred_num)
+            if num_preds == 0 and not train:
+                yield CorpusPred(self, i, -1)
+
+    def decode(self, codes):
+        strings = self.strings
+        return [strings[c] for c in codes.tolist()]
+
+    def string_array(self):
+        """`strings` as a numpy object array, for decoding whole arrays"""
+        if self._string_array is None:
+            self._string_array = np.array(self.strings, dtype=object)
+        return self._string_array
+
+    def sent_rows(self, i):
+        """The first 13 CoNLL columns of sentence i, one string per word"""
+        start, end = self.sent_offsets[i], self.sent_offsets[i + 1]
+        offsets = self.row_offsets[start:end + 1]
+        text = self.rows[offsets[0]:offsets[-1]].tobytes()
+        offsets = (offsets - offsets[0]).tolist()
+        return [text[offsets[j]:offsets[j + 1]].decode('utf-8')
+                for j in range(end - start)]
+
+    def encode(self, vocabs, labels=True):
+        """
+        Fills `ids` with vocab ids for the fields in VOCAB_FIELDS, plus
+          freqs: word counts (for word dropout)
+          fill_preds: 1 for tokens marked as predicates (Y), else 0
+        and, if `labels` (predicate disambiguation doesn't need them),
+          args: label ids for each predicate's arguments
+          pred_lemmas: lemma id of each predicate
+          frame_masks: (num_preds, num_labels) mask of allowable labels
+        Each distinct string is only looked up once.
+        """
+        def encode_codes(codes, vocab):
+            lookup = np.zeros(len(self.strings), dtype=np.int32)
+            uniq = np.unique(codes)
+            lookup[uniq] = vocab.encode_sequence(self.decode(uniq))
+            return lookup[codes]
+
+        for field in VOCAB_FIELDS:
+            self.ids[field] = encode_codes(getattr(self, field),
+                                           vocabs[field])
+        uniq = np.unique(self.words)
+        lookup = np.zeros(len(self.strings), dtype=np.int32)
+        lookup[uniq] = vocabs['words'].freqs_array(self.decode(uniq))
+        self.ids['freqs'] = lookup[self.words]
+        uniq = np.unique(self.fill_preds)
+        lookup = np.zeros(len(self.strings), dtype=np.int32)
+        lookup[uniq] = [s == 'Y' for s in self.decode(uniq)]
+        self.ids['fill_preds'] = lookup[self.fill_preds]
+        if not labels:
+            return
+        self.ids['args'] = encode_codes(self.args, vocabs['labels'])
+
+        pred_tokens = self.pred_tokens()
+        self.ids['pred_lemmas'] = self.ids['lemmas'][pred_tokens]
+
+        # Same convention as make_batch_labels_masks: no frame means every
+        # label is allowed
+        label_vocab = vocabs['labels']
+        frames = self.pred_to_frame
+        uniq, inverse = np.unique(self.lemmas[pred_tokens],
+                                  return_inverse=True)
+        masks = np.zeros((len(uniq), label_vocab.size), dtype=np.uint8)
+        for i, lemma in enumerate(self.decode(uniq)):
+            if frames.num_values(lemma) == 0:
+                masks[i, :] = 1
+            masks[i, frames.value_ids(lemma, label_vocab)] = 1
+        self.ids['frame_masks'] = masks[inverse.reshape(-1)]
+
+    def label_strings(self):
+        """
+        The label of each prediction id, followed by '_' so that a
+        prediction of -1 (none) maps to '_'.
+        """
+        vocab = self.prediction_vocab
+        if vocab is None:
+            return ['_']
+        return vocab.decode_array(np.arange(vocab.size)).tolist() + ['_']
+
+    def format_sent(self, i, label_strings):
+        """Sentence i in CoNLL format, with its predicted arguments"""
+        sent = CorpusSent(self, i)
+        predictions = sent.predictions_matrix().T.tolist()
+        out = []
+        for row, pred, labels in zip(self.sent_rows(i), sent.preds,
+                                     predictions):
+            out.append('\t'.join([row, pred] +
+                                 [label_strings[l] for l in labels]))
+        return '\n'.join(out) + '\n'
+
+    def pred_tokens(self):
+        """The corpus-wide token index of every predicate"""
+        pred_counts = np.diff(self.pred_offsets)
+        pred_sents = np.repeat(np.arange(self.num_sents), pred_counts)
+        return self.sent_offsets[pred_sents] + self.pred_idx
+
+
+class CorpusSent(object):
+    """
+    View of sentence `idx` in a Corpus, with the same fields as
+    CoNLL09_Sent (decoded to lists of strings on access).
+    """
+    __slots__ = ['corpus', 'idx']
+
+    def __init__(self, corpus, idx):
+        self.corpus = corpus
+        self.idx = idx
+
+    def __eq__(self, other):
+        return (isinstance(other, CorpusSent) and
+                self.corpus is other.corpus and self.idx == other.idx)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.corpus), self.idx))
+
+    @property
+    def start(self):
+        return int(self.corpus.sent_offsets[self.idx])
+
+    @property
+    def end(self):
+        return int(self.corpus.sent_offsets[self.idx + 1])
+
+    def __len__(self):
+        return self.end - self.start
+
+    def field(self, name):
+        return self.corpus.decode(
+            getattr(self.corpus, name)[self.start:self.end])
+
+    @property
+    def words(self):
+        return self.field('words')
+
+    @property
+    def elmo(self):
+        return self.field('forms')
+
+    @property
+    def pos(self):
+        return self.field('pos')
+
+    @property
+    def lemmas(self):
+        return self.field('lemmas')
+
+    @property
+    def plemmas(self):
+        return self.field('plemmas')
+
+    @property
+    def predicates(self):
+        return self.field('predicates')
+
+    @property
+    def preds(self):
+        return self.field('preds')
+
+    @property
+    def stags(self):
+        return self.field('stags')
+
+    @property
+    def fill_preds(self):
+        return self.field('fill_preds')
+
+    @property
+    def fill_preds_b(self):
+        return [fp == 'Y' for fp in self.fill_preds]
+
+    @property
+    def num_preds(self):
+        pred_offsets = self.corpus.pred_offsets
+        return int(pred_offsets[self.idx + 1] - pred_offsets[self.idx])
+
+    def predictions_matrix(self):
+        """
+        The predicted labels as a (num_preds, length) array of label ids,
+        -1 where there is no prediction.
+        """
+        corpus = self.corpus
+        length = len(self)
+        num_preds = self.num_preds
+        if num_preds == 0:
+            return np.zeros((0, length), dtype=np.int32)
+        start = corpus.arg_offsets[corpus.pred_offsets[self.idx]]
+        predictions = corpus.predictions[start:start + num_preds * length]
+        return predictions.reshape((num_preds, length))
+
+    def __str__(self):
+        """The sentence in CoNLL format, with predicted arguments"""
+        return self.corpus.format_sent(self.idx, self.corpus.label_strings())
+
+    def add_predicted_predicates(self, probs, vocab,
+                                 fill_all=True, lemma_to_preds=None):
+        """See CoNLL09_Sent.add_predicted_predicates"""
+        fill_preds = self.fill_preds
+        plemmas = self.plemmas
+        predicted_predicates = ['_' for _ in fill_preds]
+        for i in range(len(fill_preds)):
+            if fill_all or fill_preds[i] == 'Y':
+                if (lemma_to_preds is not None and
+                    plemmas[i] in lemma_to_preds):
+                    possibilities = list(lemma_to_preds[plemmas[i]])
+                    idxs = vocab.encode_sequence(possibilities)
+                    probabilities = [probs[i][j] for j in idxs]
+                    prediction = possibilities[np.argmax(probabilities)]
+                    predicted_predicates[i] = prediction
+                else:
+                    pred_id = np.argmax(probs[i])
+                    predicted_predicates[i] = vocab.decode(pred_id)
+        return predicted_predicates
+
+
+class CorpusPred(object):
+    """
+    View of predicate `pred_num` of sentence `sent_idx` in a Corpus, with
+    the same fields as CoNLL09_Sent_with_Pred.
+    pred_num == -1 means that this is a dummy instance for a sentence
+    with no predicates.
+    """
+    __slots__ = ['corpus', 'sent_idx', 'pred_num']
+
+    def __init__(self, corpus, sent_idx, pred_num):
+        self.corpus = corpus
+        self.sent_idx = sent_idx
+        self.pred_num = pred_num
+
+    @property
+    def parent(self):
+        return CorpusSent(self.corpus, self.sent_idx)
+
+    @property
+    def pred_id(self):
+        """Index of this predicate in the corpus-wide predicate arrays"""
+        return int(self.corpus.pred_offsets[self.sent_idx]) + self.pred_num
+
+    def __len__(self):
+        return len(self.parent)
+
+    @property
+    def length(self):
+        return len(self)
+
+    @property
+    def words(self):
+        return self.parent.words
+
+    @property
+    def elmo(self):
+        return self.parent.elmo
+
+    @property
+    def pos(self):
+        return self.parent.pos
+
+    @property
+    def lemmas(self):
+        return self.parent.lemmas
+
+    @property
+    def stags(self):
+        return self.parent.stags
+
+    @property
+    def pred_idx(self):
+        if self.pred_num == -1:
+            return 0
+        return int(self.corpus.pred_idx[self.pred_id])
+
+    @property
+    def pred(self):
+        if self.pred_num == -1:
+            return None
+        parent = self.parent
+        code = self.corpus.lemmas[parent.start + self.pred_idx]
+        return self.corpus.strings[code]
+
+    @property
+    def labels(self):
+        if self.pred_num == -1:
+            return []
+        start = self.corpus.arg_offsets[self.pred_id]
+        return self.corpus.decode(self.corpus.args[start:start + len(self)])
+
+    @property
+    def frame(self):
+        if self.pred_num == -1:
+            return []
+        return self.corpus.pred_to_frame.get(self.pred, [])
+
+    def add_predictions(self, probs, vocab, restrict_labels=False):
+        """
+        Stores the most probable label for each word (probs is shaped
+        (seq_length, num_labels)) in the corpus' predictions array, to be
+        written to file later.
+        """
+        if self.pred_num == -1:
+            return
+        length = len(self)
+        start = self.corpus.arg_offsets[self.pred_id]
+        self.corpus.predictions[start:start + length] = np.argmax(
+            probs[:length], axis=1)
+        self.corpus.prediction_vocab = vocab
+
+
+class PredictionWriter(object):
+    """
+    Writes a Corpus with its predictions to a CoNLL file during testing.
+    Call `add` with each batch of CorpusPred instances once their
+    predictions are stored: every sentence is written, in order, as soon
+    as all of its predicates have been decoded. Output goes through a
+    buffer of about `buffer_size` characters, and `close` writes whatever
+    is left. Used as a context manager, it is closed even if testing fails
+    (writing only the sentences that were finished).
+    """
+    def __init__(self, corpus, fn, buffer_size=1 << 20):
+        self.corpus = corpus
+        self.f = open_file(fn, 'w')
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        ## Undecoded predicates in each sentence
+        self.remaining = np.diff(corpus.pred_offsets).astype(np.int32)
+        self.next_sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(write_all=exc_type is None)
+
+    def add(self, pred_instances):
+        for inst in pred_instances:
+            if inst.pred_num != -1:
+                self.remaining[inst.sent_idx] -= 1
+        self.write_ready()
+
+    def write_ready(self, write_all=False):
+        num_sents = self.corpus.num_sents
+        remaining = self.remaining
+        label_strings = None
+        while self.next_sent < num_sents and (
+                write_all or remaining[self.next_sent] <= 0):
+            if label_strings is None:
+                label_strings = self.corpus.label_strings()
+            text = self.corpus.format_sent(self.next_sent, label_strings)
+            self.buffer.append(text)
+            self.buffer.append('\n')
+            self.buffered += len(text) + 1
+            if self.buffered >= self.buffer_size:
+                self.flush()
+            self.next_sent += 1
+
+    def flush(self):
+        self.f.write(''.join(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self, write_all=True):
+        if self.f is None:
+            return
+        if write_all:
+            self.write_ready(write_all=True)
+        self.flush()
+        self.f.close()
+        self.f = None
+
+
+class CorpusBuilder(object):
+    """
+    Builds a Corpus one sentence at a time, without creating any
+    per-sentence objects. Sentences are added as lists of CoNLL lines
+    (split on tabs), each followed by the predicates and supertag columns,
+    as in conll09_generator.
+    """
+    def __init__(self):
+        self.strings = []
+        self.string_codes = {}
+
+        ## (words are filled in from the forms in `build`)
+        self.columns = {field: array('i') for field in TOKEN_FIELDS
+                        if field != 'words'}
+        self.sent_offsets = array('q', [0])
+        self.pred_offsets = array('q', [0])
+        self.pred_idx = array('i')
+        self.arg_offsets = array('q')
+        self.args = array('i')
+        self.rows = []
+        self.row_offsets = array('q', [0])
+
+    def intern(self, s):
+        code = self.string_codes.get(s)
+        if code is None:
+            code = len(self.strings)
+            self.string_codes[s] = code
+            self.strings.append(s)
+        return code
+
+    def add_sent(self, lines):
+        intern = self.intern
+        columns = self.columns
+        for line in lines:
+            columns['forms'].append(intern(line[1]))
+            columns['pos'].append(intern(line[5]))
+            columns['stags'].append(intern(line[-1]))
+            columns['preds'].append(intern(line[-2]))
+            if line[12] == 'Y':
+                columns['lemmas'].append(intern(line[-2].split('.')[0]))
+            else:
+                columns['lemmas'].append(intern('_'))
+            columns['plemmas'].append(intern(line[3]))
+            columns['predicates'].append(intern(line[13]))
+            columns['fill_preds'].append(intern(line[12]))
+            row = '\t'.join(line[:13]).encode('utf-8')
+            self.rows.append(row)
+            self.row_offsets.append(self.row_offsets[-1] + len(row))
+
+        # Argument labels for each predicate, as in CoNLL09_Sent
+        pred_num = 0
+        for i, line in enumerate(lines):
+            if line[12] == 'Y':
+                self.pred_idx.append(i)
+                self.arg_offsets.append(len(self.args))
+                self.args.extend(intern(l[14 + pred_num]) for l in lines)
+                pred_num += 1
+        self.sent_offsets.append(self.sent_offsets[-1] + len(lines))
+        self.pred_offsets.append(self.pred_offsets[-1] + pred_num)
+
+    def build(self, language='eng'):
+        arrays, strings = self.build_arrays()
+        return Corpus(arrays, strings, language)
+
+    def build_arrays(self):
+        """The arrays and string table for a Corpus, without the Corpus
+        (e.g. to send back from a worker process)"""
+        strings = self.strings
+        arrays = {field: np.frombuffer(self.columns[field], dtype=np.int32)
+                  for field in TOKEN_FIELDS if field != 'words'}
+
+        # Normalization only depends on the form, so normalize the distinct
+        # forms in one go and map the words column through them
+        forms = np.unique(arrays['forms'])
+        form_to_word = np.zeros(len(strings), dtype=np.int32)
+        words = normalize_column([strings[c] for c in forms.tolist()])
+        form_to_word[forms] = [self.intern(word) for word in words]
+        arrays['words'] = form_to_word[arrays['forms']]
+        arrays['sent_offsets'] = np.frombuffer(self.sent_offsets,
+                                               dtype=np.int64)
+        arrays['pred_offsets'] = np.frombuffer(self.pred_offsets,
+                                               dtype=np.int64)
+        arrays['pred_idx'] = np.frombuffer(self.pred_idx, dtype=np.int32)
+        arrays['arg_offsets'] = np.frombuffer(self.arg_offsets,
+                                              dtype=np.int64)
+        arrays['args'] = np.frombuffer(self.args, dtype=np.int32)
+        arrays['rows'] = np.frombuffer(b''.join(self.rows), dtype=np.uint8)
+        arrays['row_offsets'] = np.frombuffer(self.row_offsets,
+                                              dtype=np.int64)
+        return arrays, strings
+
+
+def split_line(line, pred, stag):
+    """One CoNLL line plus its predicate and supertag, as CorpusBuilder
+    expects them"""
+    line = line.strip().split('\t')
+    line.append(pred.strip())
+    line.append(stag.strip())
+    return line
+
+
+def group_sent_lines(txt_lines, pred_lines, stag_lines):
+    """Groups three parallel iterables of lines into sentences"""
+    lines = []
+    for line, pred, stag in zip(txt_lines, pred_lines, stag_lines):
+        if line == '\n':
+            yield lines
+            lines = []
+        else:
+            lines.append(split_line(line, pred, stag))
+
+
+def sent_line_generator(fn_txt, fn_preds, fn_stags):
+    """Yields the lines of each sentence in the three parallel files"""
+    fs = [open_file(fn) for fn in [fn_txt, fn_preds, fn_stags]]
+    for lines in group_sent_lines(*fs):
+        yield lines
+    [f.close() for f in fs]
+
+
+def read_corpus(fn_txt, fn_preds, fn_stags, language='eng'):
+    """
+    Reads the same data as conll09_generator into a Corpus.
+    """
+    builder = CorpusBuilder()
+    for lines in sent_line_generator(fn_txt, fn_preds, fn_stags):
+        builder.add_sent(lines)
+    return builder.build(language)
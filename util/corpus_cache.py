@@ -0,0 +1,120 @@
+# corpus_cache.py
+# Compiles CoNLL-09 data (text, predicates and supertags) into a binary cache
+# of integer arrays, so it doesn't have to be re-parsed on every run
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import json
+import shutil
+import numpy as np
+
+from util.corpus import Corpus, ARRAYS
+from util.files import file_hash, get_cache_dir
+from util.parallel_reader import read_corpus_parallel
+from util.vocab import get_vocabs
+
+# Bump this whenever the layout of the cache changes
+CACHE_VERSION = 3
+
+# Vocab-encoded arrays (Corpus.ids) stored in the cache
+ID_ARRAYS = ['words', 'pos', 'lemmas', 'plemmas', 'stags', 'predicates',
+             'freqs', 'fill_preds', 'args', 'pred_lemmas', 'frame_masks']
+
+
+def get_cache_meta(fn_txt, fn_preds, fn_stags, vocabs, language):
+    """The metadata a cache must match to be up to date"""
+    fn_frames = 'data/{}/frames.txt'.format(language)
+    sources = {}
+    for fn in [fn_txt, fn_preds, fn_stags, fn_frames]:
+        sources[fn] = file_hash(fn)
+    return {
+        'version': CACHE_VERSION,
+        'language': language,
+        'sources': sources,
+        'vocabs': {t: v.version for t, v in sorted(vocabs.items())}
+    }
+
+
+def compile_corpus_cache(fn_txt, fn_preds, fn_stags, vocabs, language,
+                         cache_dir, meta=None, num_workers=1):
+    """
+    Parses the CoNLL files once into a Corpus (with num_workers processes),
+    encodes it with `vocabs` and writes every array to `cache_dir` as a
+    .npy file, along with meta.json.
+    """
+    if meta is None:
+        meta = get_cache_meta(fn_txt, fn_preds, fn_stags, vocabs, language)
+    corpus = read_corpus_parallel(fn_txt, fn_preds, fn_stags, language,
+                                  num_workers)
+    corpus.encode(vocabs)
+
+    # Write to a temporary directory first so that an interrupted compile
+    # never leaves a half-written cache behind
+    tmp_dir = cache_dir.rstrip('/') + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp_dir, name + '.npy'), getattr(corpus, name))
+    for name in ID_ARRAYS:
+        np.save(os.path.join(tmp_dir, 'ids.{}.npy'.format(name)),
+                corpus.ids[name])
+    ## Strings can't contain newlines in CoNLL files, so store the string
+    ## table as one newline-separated blob
+    strings = '\n'.join(corpus.strings).encode('utf-8')
+    np.save(os.path.join(tmp_dir, 'strings.npy'),
+            np.frombuffer(strings, dtype=np.uint8))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.rename(tmp_dir, cache_dir)
+
+
+def cache_is_fresh(cache_dir, meta):
+    fn_meta = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(fn_meta):
+        return False
+    with open(fn_meta, 'r') as f:
+        return json.load(f) == meta
+
+
+def load_corpus_cache(cache_dir, language='eng'):
+    """
+    Loads a compiled Corpus, with every array memory-mapped from disk.
+    """
+    def load(name):
+        return np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r')
+    arrays = {name: load(name) for name in ARRAYS}
+    ids = {name: load('ids.' + name) for name in ID_ARRAYS}
+    strings = load('strings').tobytes().decode('utf-8').split('\n')
+    return Corpus(arrays, strings, language, ids=ids)
+
+
+def get_corpus_cache(fn_txt, fn_preds, fn_stags, vocabs, language,
+                     cache_dir=None, num_workers=1):
+    """
+    Returns the Corpus for the given files from its cache, compiling the
+    cache first if there is none yet or if the data files or vocabs have
+    changed since it was compiled.
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir(fn_txt, fn_preds, fn_stags)
+    meta = get_cache_meta(fn_txt, fn_preds, fn_stags, vocabs, language)
+    if not cache_is_fresh(cache_dir, meta):
+        print('Compiling corpus cache for {}...'.format(fn_txt))
+        compile_corpus_cache(fn_txt, fn_preds, fn_stags, vocabs, language,
+                             cache_dir, meta, num_workers)
+    return load_corpus_cache(cache_dir, language)
+
+
+if __name__ == '__main__':
+    # Usage: python -m util.corpus_cache language stag_type txt preds stags
+    language, stag_type, fn_txt, fn_preds, fn_stags = sys.argv[1:6]
+    vocabs = get_vocabs(language, stag_type)
+    corpus = get_corpus_cache(fn_txt, fn_preds, fn_stags, vocabs, language)
+    print('{} sentences, {} predicates in {}'.format(
+        corpus.num_sents, corpus.num_preds,
+        get_cache_dir(fn_txt, fn_preds, fn_stags)))
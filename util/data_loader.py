@@ -6,6 +6,8 @@ import numpy as np
 
 from util.conll_io import CoNLL09_Sent, CoNLL09_Sent_with_Pred
 from util.conll_io import conll09_generator, get_lemma_to_preds
+from util.corpus_cache import get_corpus_cache
+from util.parallel_reader import read_corpus_parallel
 
 
 
@@ -52,6 +54,25 @@ def make_batch_field_single(sents, field, vocab=None):
     return data
 
 
+def make_batch_elmo(sents, seq_length):
+    """
+    ELMo runs once per distinct sentence in a batch: returns the tokens of
+    each distinct sentence, and for each instance the index of its sentence
+    among them
+    """
+    sent_nums = {}
+    distinct = []
+    elmo_idx = np.zeros((len(sents),), dtype=np.int32)
+    for i, sent in enumerate(sents):
+        key = tuple(sent.elmo)
+        if key not in sent_nums:
+            sent_nums[key] = len(distinct)
+            distinct.append(sent)
+        elmo_idx[i] = sent_nums[key]
+    elmo = make_batch_field_sequence(distinct, 'elmo', seq_length, None)
+    return elmo, elmo_idx
+
+
 def make_batch_freqs(sents, seq_length, vocab):
     data = np.zeros((len(sents), seq_length), dtype=np.int32)
     for i, sent in enumerate(sents):
@@ -72,16 +93,16 @@ def make_batch(sents, vocabs, train):
       labels_mask_placeholder = tf.placeholder(
         tf.float32, shape=(batch_size, vocabs['labels'].size))    
       stags_placeholder = tf.placeholder(tf.int32, shape=(batch_size, None))
-    in that order.
+    in that order, preceded by the ELMo tokens of each distinct sentence and
+    followed by the sequence lengths and each instance's index into the
+    ELMo sentences (see make_batch_elmo).
     There is one predicate for each sentence.
       preds_placeholder is a list of encoded predicates
       preds_idx_placeholder is the index of each predicate in the
         corresponding sentence
     """
     seq_length = max(len(sent) for sent in sents)
-    elmo = make_batch_field_sequence(sents, 'elmo',
-                                      seq_length, None,
-                                      use_dropout=False)
+    elmo, elmo_idx = make_batch_elmo(sents, seq_length)
     words = make_batch_field_sequence(sents, 'words',
                                       seq_length, vocabs['words'],
                                       use_dropout=False)
@@ -99,36 +120,271 @@ def make_batch(sents, vocabs, train):
                                       seq_length, vocabs['stags'])
     seq_lengths = make_batch_field_single(sents, 'length')
     return (elmo, words, freqs, pos, lemmas, preds, preds_idx,
-            labels, labels_mask_placeholder, stags, seq_lengths)
+            labels, labels_mask_placeholder, stags, seq_lengths, elmo_idx)
+
+
+class TokenGrid(object):
+    """
+    Token indices into a Corpus for every (sentence, position) pair of a
+    batch of sentences, with padding positions pointed at token 0 (and
+    zeroed out by `gather`).
+    """
+    def __init__(self, corpus, sent_idxs):
+        self.corpus = corpus
+        starts = corpus.sent_offsets[sent_idxs]
+        self.seq_lengths = (corpus.sent_offsets[sent_idxs + 1] -
+                            starts).astype(np.int32)
+        self.seq_length = self.seq_lengths.max()
+        self.positions = np.arange(self.seq_length)
+        self.pad_mask = self.positions[None, :] < self.seq_lengths[:, None]
+        self.token_idxs = np.where(self.pad_mask,
+                                   starts[:, None] + self.positions, 0)
+
+    def gather(self, field):
+        """The (batch_size, seq_length) ids of an encoded field"""
+        return np.where(self.pad_mask,
+                        self.corpus.ids[field][self.token_idxs],
+                        0).astype(np.int32)
+
+    def gather_strings(self, field):
+        """The strings of a token field, padded with empty strings"""
+        data = np.zeros(self.pad_mask.shape).astype(str)
+        codes = getattr(self.corpus, field)[self.token_idxs[self.pad_mask]]
+        data[self.pad_mask] = self.corpus.string_array()[codes]
+        return data
+
+
+def make_corpus_batch(corpus, sents, vocabs):
+    """
+    Same as make_batch, but for CorpusPred objects from an encoded Corpus:
+    all of the ids are gathered straight from the corpus' id arrays.
+    If the corpus has an ElmoCache (corpus.elmo_cache), the batch holds
+    the ELMo vectors of each distinct sentence instead of its tokens.
+    """
+    ids = corpus.ids
+    sent_idxs = np.array([sent.sent_idx for sent in sents])
+    pred_nums = np.array([sent.pred_num for sent in sents])
+    grid = TokenGrid(corpus, sent_idxs)
+    gather = grid.gather
+    seq_lengths = grid.seq_lengths
+    positions = grid.positions
+    pad_mask = grid.pad_mask
+
+    # One ELMo row per distinct sentence (all the sentences of the batch are
+    # among them, so their grid has the same seq_length)
+    _, first, elmo_idx = np.unique(sent_idxs, return_index=True,
+                                   return_inverse=True)
+    if corpus.elmo_cache is not None:
+        elmo = corpus.elmo_cache.gather(sent_idxs[first], grid.seq_length)
+    else:
+        elmo = TokenGrid(corpus, sent_idxs[first]).gather_strings('forms')
+    words = gather('words')
+    freqs = gather('freqs')
+    pos = gather('pos')
+    lemmas = gather('lemmas')
+    stags = gather('stags')
+
+    # Sentences without predicates (pred_num == -1) get an unknown predicate
+    # at index 0, no labels and no label restrictions, like in make_batch
+    has_pred = pred_nums != -1
+    pred_ids = np.where(has_pred,
+                        corpus.pred_offsets[sent_idxs] + pred_nums, 0)
+    preds = np.where(has_pred, ids['pred_lemmas'][pred_ids],
+                     vocabs['lemmas'].unk_idx).astype(np.int32)
+    preds_idx = np.where(has_pred, corpus.pred_idx[pred_ids], 0).astype(
+        np.int32)
+    arg_idxs = np.where(pad_mask, corpus.arg_offsets[pred_ids][:, None] +
+                        positions, 0)
+    labels = np.where(pad_mask & has_pred[:, None],
+                      ids['args'][arg_idxs], 0).astype(np.int32)
+    labels_mask = np.where(has_pred[:, None],
+                           ids['frame_masks'][pred_ids], 1).astype(np.float32)
+    return (elmo, words, freqs, pos, lemmas, preds, preds_idx,
+            labels, labels_mask, stags, seq_lengths,
+            elmo_idx.reshape(-1).astype(np.int32))
+
+
+def load_corpus(fn_txt, fn_preds, fn_stags, vocabs, language,
+                use_cache=False, num_workers=1):
+    """
+    Returns a Corpus (see util/corpus.py) for the given files.
+    If use_cache is set, the corpus is read from a binary cache (compiled
+      on first use, see util/corpus_cache.py) instead of the text files.
+    With num_workers > 1 the text files are parsed by that many processes
+      (see util/parallel_reader.py).
+    The corpus is always encoded with `vocabs`, so batches can be gathered
+      straight from its id arrays (see make_corpus_batch).
+    """
+    if use_cache:
+        return get_corpus_cache(fn_txt, fn_preds, fn_stags, vocabs, language,
+                                num_workers=num_workers)
+    corpus = read_corpus_parallel(fn_txt, fn_preds, fn_stags, language,
+                                  num_workers)
+    corpus.encode(vocabs)
+    return corpus
+
+
+class PaddingStats(object):
+    """
+    Counts the real and padded tokens in the batches of an epoch, to see
+    how much of each batch is padding.
+    """
+    def __init__(self):
+        self.num_batches = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    def add(self, lengths, batch_size):
+        """lengths: the lengths of the instances in a batch of
+        batch_size instances"""
+        self.num_batches += 1
+        self.real_tokens += int(np.sum(lengths))
+        self.padded_tokens += batch_size * int(np.max(lengths))
+
+    @property
+    def waste(self):
+        if self.padded_tokens == 0:
+            return 0.0
+        return 1 - self.real_tokens / self.padded_tokens
+
+    def __str__(self):
+        return '{} batches, {} tokens, {:.1f}% padding'.format(
+            self.num_batches, self.padded_tokens, 100 * self.waste)
+
+
+def token_budget_batches(idxs, lengths, max_tokens):
+    """
+    Cuts idxs (in order) into batches of at most max_tokens tokens once
+    padded to their longest instance. An instance longer than max_tokens
+    gets a batch to itself.
+    """
+    batches = []
+    start = 0
+    longest = 0
+    for k, length in enumerate(np.asarray(lengths)[idxs].tolist()):
+        longest = max(longest, length)
+        if k > start and (k - start + 1) * longest > max_tokens:
+            batches.append(idxs[start:k])
+            start = k
+            longest = length
+    if start < len(idxs):
+        batches.append(idxs[start:])
+    return batches
+
+
+def batch_order(lengths, batch_size, bucket_width=0, rng=None,
+                max_tokens=0):
+    """
+    Splits instances 0..len(lengths)-1 into batches, returned as a list of
+    index arrays.
+    Batches hold batch_size instances, or if max_tokens > 0, as many
+      instances as fit in max_tokens padded tokens.
+    With bucket_width == 0 the batches are cut in corpus order.
+    Otherwise instances are grouped into buckets of lengths
+      [0, bucket_width), [bucket_width, 2*bucket_width), ... and batches
+      are cut from the buckets in order of length, so each batch holds
+      instances of similar length.
+    If rng (a np.random.RandomState) is given, instances are shuffled
+      within each bucket and the batches are shuffled too.
+    """
+    idxs = np.arange(len(lengths))
+    if bucket_width > 0:
+        if rng is not None:
+            idxs = rng.permutation(len(lengths))
+        ## A stable sort keeps the shuffled order within each bucket
+        buckets = np.asarray(lengths)[idxs] // bucket_width
+        idxs = idxs[np.argsort(buckets, kind='mergesort')]
+    if max_tokens > 0:
+        batches = token_budget_batches(idxs, lengths, max_tokens)
+    else:
+        batches = [idxs[i:i + batch_size]
+                   for i in range(0, len(idxs), batch_size)]
+    if bucket_width > 0 and rng is not None:
+        batches = [batches[i] for i in rng.permutation(len(batches))]
+    return batches
+
+
+def corpus_batch_plan(batch_size, corpus, train=True, bucket_width=0,
+                      rng=None, stats=None, max_tokens=0, by_sentence=False):
+    """
+    The CorpusPred instances of each batch from a Corpus, without building
+    the batches themselves (see corpus_batch_producer).
+    With by_sentence, batches hold whole sentences along with all of their
+      predicates (for --sentence_layers), so batch_size and max_tokens count
+      sentences rather than instances, and batches vary in size.
+    """
+    ## Sentences without predicates are left out even when testing: there
+    ## is nothing to run the model on, and PredictionWriter writes them as
+    ## soon as the sentences before them are done
+    instances = list(corpus.pred_instances(train=True))
+    if len(instances) == 0:
+        return []
+    sent_lengths = np.diff(corpus.sent_offsets)
+    inst_sents = np.array([inst.sent_idx for inst in instances])
+    if by_sentence:
+        ## The instances of a sentence are consecutive
+        sent_idxs, starts = np.unique(inst_sents, return_index=True)
+        groups = np.split(np.arange(len(instances)), starts[1:])
+        lengths = sent_lengths[sent_idxs]
+    else:
+        lengths = sent_lengths[inst_sents]
+    plan = []
+    for idxs in batch_order(lengths, batch_size, bucket_width, rng,
+                            max_tokens):
+        if by_sentence:
+            sents = [instances[i] for i in np.concatenate(
+                [groups[k] for k in idxs])]
+        else:
+            sents = [instances[i] for i in idxs]
+        if stats is not None:
+            stats.add(lengths[idxs], len(idxs))
+        plan.append(sents)
+    return plan
+
+
+def corpus_batch_producer(batch_size, vocabs, corpus, train=True,
+                          bucket_width=0, rng=None, stats=None,
+                          max_tokens=0, by_sentence=False):
+    """
+    Yields batches of CorpusPred instances from a Corpus, along with the
+    instances themselves (see batch_producer).
+    See batch_order for bucket_width, rng and max_tokens, and
+      corpus_batch_plan for by_sentence. The model takes batches of any
+      size, so the last batch just holds whatever instances are left.
+    Each instance knows its
+      sentence and predicate, so output can be written in the original
+      order whatever order the batches come in (see PredictionWriter).
+    If stats (a PaddingStats) is given, it counts the padding in each batch.
+    """
+    plan = corpus_batch_plan(batch_size, corpus, train, bucket_width, rng,
+                             stats, max_tokens, by_sentence)
+    for sents in plan:
+        yield sents, make_batch_from_corpus(corpus, sents, vocabs, train)
+
+
+def make_batch_from_corpus(corpus, sents, vocabs, train):
+    # An encoded corpus (e.g. from load_corpus) already has all the ids
+    if corpus.ids:
+        return make_corpus_batch(corpus, sents, vocabs)
+    return make_batch(sents, vocabs, train)
+
 
-    
 def batch_producer(batch_size, vocabs, fn_txt, fn_preds, fn_stags,
-                   language, train=True):
+                   language, train=True, use_cache=False, num_workers=1,
+                   bucket_width=0, rng=None, stats=None, max_tokens=0):
     """
     vocabs should be a dictionary of Vocab objects keyed "words", "pos", etc.
     See `make_batch` for details about what's in a batch.
     Returns the batch and also the corresponding list of sentence objects
       (useful for evaluation)
+    See load_corpus for use_cache and num_workers, and
+      corpus_batch_producer for bucket_width, rng, stats and max_tokens.
     """
-    all_sents = [s for s in conll09_generator(
-        fn_txt, fn_preds, fn_stags, language)]
-    # if train:
-    #     all_sents = sorted(all_sents, key=lambda s: -len(s))
-    sents = []
-    for sent in all_sents: #conll09_generator(fn_txt, fn_preds, fn_stags):
-        # During training, skip sentences without predicates
-        # (but include them during testing to make it simpler to write
-        # predictions to file)
-        if sent.pred is not None or not train:
-            sents.append(sent)
-        # sents.append(sent)
-        if len(sents) == batch_size:
-            yield sents, make_batch(sents, vocabs, train)
-            sents = []
-    # Fill out the last batch if the data doesn't evenly divide
-    if len(sents) > 0 and len(sents) < batch_size:
-        sents += [sents[0] for _ in range(batch_size - len(sents))]
-        yield sents, make_batch(sents, vocabs, train)
+    corpus = load_corpus(fn_txt, fn_preds, fn_stags, vocabs, language,
+                         use_cache, num_workers)
+    for batch in corpus_batch_producer(batch_size, vocabs, corpus, train,
+                                       bucket_width, rng, stats, max_tokens):
+        yield batch
 
 def make_fill_preds_batch(sents, seq_length):
     batch = np.zeros((len(sents), seq_length), dtype=np.int32)
@@ -154,23 +410,35 @@ def make_disamb_batch(sents, vocabs, train):
                                       seq_length, vocabs['stags'])
     fill_preds = make_fill_preds_batch(sents, seq_length)
     return words, pos, lemmas, labels, stags, fill_preds
+
+
+def make_corpus_disamb_batch(corpus, sents):
+    """
+    Same as make_disamb_batch, but for CorpusSent objects from an encoded
+    Corpus.
+    """
+    grid = TokenGrid(corpus, np.array([sent.idx for sent in sents]))
+    return (grid.gather('words'), grid.gather('pos'), grid.gather('plemmas'),
+            grid.gather('predicates'), grid.gather('stags'),
+            grid.gather('fill_preds'))
     
 
 
 def disamb_batch_producer(batch_size, vocabs, fn_txt, fn_stags,
-                          language, train=True):
-    all_sents = [s for s in conll09_generator(
-        fn_txt, fn_stags, fn_stags, language, only_sent=True)]
+                          language, train=True, num_workers=1, max_tokens=0):
+    """
+    Yields batches of sentences for predicate disambiguation. With
+    max_tokens > 0, batches are sized to hold at most that many padded
+    tokens (see batch_order) instead of batch_size sentences. The last
+    batch just holds whatever sentences are left.
+    """
+    corpus = read_corpus_parallel(fn_txt, fn_stags, fn_stags, language,
+                                  num_workers)
+    corpus.encode(vocabs, labels=False)
+    all_sents = list(corpus.sents())
     if train:
         all_sents = sorted(all_sents, key=lambda s: -len(s))
-    sents = []
-    for sent in all_sents:
-        sents.append(sent)
-        if len(sents) == batch_size:
-            yield sents, make_disamb_batch(sents, vocabs, train)
-            sents = []
-    # Fill out the last batch if the data doesn't evenly divide
-    if len(sents) > 0 and len(sents) < batch_size:
-        sents += [all_sents[i] for i in range(batch_size - len(sents))]
-        yield sents, make_disamb_batch(sents, vocabs, train)
-            
+    lengths = np.array([len(sent) for sent in all_sents])
+    for idxs in batch_order(lengths, batch_size, max_tokens=max_tokens):
+        sents = [all_sents[i] for i in idxs]
+        yield sents, make_corpus_disamb_batch(corpus, sents)
@@ -0,0 +1,132 @@
+# elmo_cache.py
+# ELMo layer outputs for every token of a split, computed once (see
+# model/elmo_features.py) and memory-mapped at training time, so the ELMo
+# module doesn't have to run on every batch of every epoch (or be
+# available at all)
+from __future__ import print_function
+from __future__ import division
+
+import os
+import json
+import shutil
+import numpy as np
+
+from util.corpus_cache import cache_is_fresh
+from util.data_loader import TokenGrid
+from util.files import file_hash, base_name
+
+# Bump this whenever the layout of the cache changes
+ELMO_CACHE_VERSION = 2
+
+
+def get_elmo_cache_dir(fn_txt):
+    """
+    The cache lives next to the text file, e.g. data/eng/conll09/cache/
+    dev.elmo/ (ELMo only depends on the words, so one cache serves every
+    combination of predicate and supertag files)
+    """
+    return os.path.join(os.path.dirname(fn_txt), 'cache',
+                        '{}.elmo'.format(base_name(fn_txt)))
+
+
+def get_elmo_meta(fn_txt, module):
+    return {
+        'version': ELMO_CACHE_VERSION,
+        'source': file_hash(fn_txt),
+        'module': module
+    }
+
+
+def write_elmo_cache(cache_dir, corpus, compute, meta, batch_size=32):
+    """
+    Runs compute(tokens, lengths), which returns the (n, seq_length, ...)
+    ELMo outputs of n padded sentences (e.g. (n, seq_length, num_layers,
+    dim)), over every sentence of `corpus` (batch_size at a time, sorted by
+    length to keep padding down) and writes the outputs for the real
+    tokens to `cache_dir` as float16, in corpus order.
+    """
+    tmp_dir = '{}.tmp{}'.format(cache_dir.rstrip('/'), os.getpid())
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    lengths = np.diff(corpus.sent_offsets)
+    order = np.argsort(lengths, kind='mergesort')
+    num_tokens = int(corpus.sent_offsets[-1])
+    vectors = None
+    for start in range(0, len(order), batch_size):
+        grid = TokenGrid(corpus, order[start:start + batch_size])
+        output = compute(grid.gather_strings('forms'), grid.seq_lengths)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(
+                os.path.join(tmp_dir, 'vectors.npy'), mode='w+',
+                dtype=np.float16, shape=(num_tokens,) + output.shape[2:])
+        vectors[grid.token_idxs[grid.pad_mask]] = output[grid.pad_mask]
+    if vectors is None:
+        np.save(os.path.join(tmp_dir, 'vectors.npy'),
+                np.zeros((0, 0), dtype=np.float16))
+    else:
+        vectors.flush()
+        del vectors
+
+    np.save(os.path.join(tmp_dir, 'sent_offsets.npy'), corpus.sent_offsets)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        os.rename(tmp_dir, cache_dir)
+    except OSError:
+        ## Another run finished the same cache first
+        shutil.rmtree(tmp_dir)
+
+
+class ElmoCache(object):
+    """
+    The ELMo outputs of a split, memory-mapped: the outputs for sentence i
+    are vectors[sent_offsets[i]:sent_offsets[i+1]], with sentences in the
+    same order as the Corpus of the split. Each token has an array of
+    shape `feature_shape` (ELMo's layers by their size).
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.vectors = np.load(os.path.join(cache_dir, 'vectors.npy'),
+                               mmap_mode='r')
+        self.sent_offsets = np.load(os.path.join(cache_dir,
+                                                 'sent_offsets.npy'))
+        self.feature_shape = self.vectors.shape[1:]
+
+    def __len__(self):
+        return len(self.sent_offsets) - 1
+
+    def sentence(self, i):
+        """The outputs for the tokens of sentence i"""
+        return self.vectors[self.sent_offsets[i]:self.sent_offsets[i + 1]]
+
+    def check(self, corpus):
+        """Raises a ValueError unless the cache matches the corpus"""
+        if not np.array_equal(self.sent_offsets, corpus.sent_offsets):
+            raise ValueError('ELMo cache {} does not match the corpus'.format(
+                self.cache_dir))
+
+    def gather(self, sent_idxs, seq_length):
+        """
+        The outputs for the given sentences as a (len(sent_idxs),
+        seq_length) + feature_shape float32 array, padded with zeros
+        """
+        starts = self.sent_offsets[sent_idxs]
+        lengths = self.sent_offsets[sent_idxs + 1] - starts
+        positions = np.arange(seq_length)
+        pad_mask = positions[None, :] < lengths[:, None]
+        data = np.zeros((len(sent_idxs), seq_length) + self.feature_shape,
+                        dtype=np.float32)
+        data[pad_mask] = self.vectors[(starts[:, None] + positions)[pad_mask]]
+        return data
+
+
+def get_elmo_cache(fn_txt, module):
+    """The ElmoCache for a text file, or None if it is missing or stale"""
+    cache_dir = get_elmo_cache_dir(fn_txt)
+    if not cache_is_fresh(cache_dir, get_elmo_meta(fn_txt, module)):
+        return None
+    return ElmoCache(cache_dir)
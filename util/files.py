@@ -0,0 +1,135 @@
+# files.py
+# Helpers for data files and the caches derived from them
+import io
+import os
+import gzip
+import lzma
+import shutil
+import hashlib
+import tempfile
+import contextlib
+import numpy as np
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+## Compressed files are recognized by extension
+COMPRESSED_EXTS = ['.gz', '.xz', '.zst']
+
+## Compressed data is read and written in blocks of this size
+BLOCK_SIZE = 1 << 20
+
+
+def is_compressed(fn):
+    return os.path.splitext(fn)[1] in COMPRESSED_EXTS
+
+
+def resolve_path(fn):
+    """
+    fn itself if it exists, otherwise a compressed version of it
+    (fn + '.gz', etc) if there is one, so that data files can be compressed
+    in place without changing any paths.
+    """
+    if os.path.exists(fn) or is_compressed(fn):
+        return fn
+    for ext in COMPRESSED_EXTS:
+        if os.path.exists(fn + ext):
+            return fn + ext
+    return fn
+
+
+def base_name(fn):
+    """The file name without directory, compression or other extension,
+    e.g. 'train' for data/eng/conll09/train.txt.gz"""
+    name = os.path.basename(fn)
+    if is_compressed(name):
+        name = os.path.splitext(name)[0]
+    return os.path.splitext(name)[0]
+
+
+def open_file(fn, mode='r', block_size=BLOCK_SIZE):
+    """
+    Opens a text file for reading ('r') or writing ('w'), compressed with
+    gzip, xz or zstd if its name ends in .gz, .xz or .zst. (De)compression
+    is streamed through buffers of `block_size` bytes. Reading also finds
+    compressed versions of uncompressed paths (see resolve_path).
+    """
+    if mode not in ['r', 'w']:
+        raise ValueError('open_file only supports modes r and w')
+    if mode == 'r':
+        fn = resolve_path(fn)
+    ext = os.path.splitext(fn)[1]
+    if ext not in COMPRESSED_EXTS:
+        return open(fn, mode)
+
+    if ext == '.gz':
+        raw = gzip.open(fn, mode + 'b', compresslevel=6)
+    elif ext == '.xz':
+        raw = lzma.open(fn, mode + 'b')
+    else:
+        if zstandard is None:
+            raise ImportError('reading or writing {} requires the zstandard '
+                              'package'.format(fn))
+        if mode == 'r':
+            raw = zstandard.ZstdDecompressor().stream_reader(
+                open(fn, 'rb'), read_size=block_size, closefd=True)
+        else:
+            raw = zstandard.ZstdCompressor().stream_writer(
+                open(fn, 'wb'), write_size=block_size, closefd=True)
+    if mode == 'r':
+        buffered = io.BufferedReader(raw, buffer_size=block_size)
+    else:
+        buffered = io.BufferedWriter(raw, buffer_size=block_size)
+    return io.TextIOWrapper(buffered, encoding='utf-8')
+
+
+@contextlib.contextmanager
+def uncompressed_path(fn):
+    """
+    Yields the path of an uncompressed copy of fn, for tools that can only
+    read plain files (the copy is a temporary file, removed afterwards).
+    """
+    fn = resolve_path(fn)
+    if not is_compressed(fn):
+        yield fn
+        return
+    f_tmp = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+    try:
+        with f_tmp, open_file(fn, 'r') as f:
+            shutil.copyfileobj(f, f_tmp, BLOCK_SIZE)
+        yield f_tmp.name
+    finally:
+        os.remove(f_tmp.name)
+
+
+def file_hash(fn, block_size=1 << 20):
+    """Returns the sha1 hex digest of a file's contents"""
+    h = hashlib.sha1()
+    with open(resolve_path(fn), 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            h.update(block)
+            block = f.read(block_size)
+    return h.hexdigest()
+
+
+def get_cache_dir(fn_txt, fn_preds, fn_stags):
+    """
+    Caches live next to the text file, e.g.
+      data/eng/conll09/cache/dev_1a2b3c4d5e/
+    with a key for the combination of predicate and supertag files.
+    """
+    paths = [os.path.abspath(fn) for fn in [fn_txt, fn_preds, fn_stags]]
+    key = hashlib.md5('\n'.join(paths).encode('utf-8')).hexdigest()[:10]
+    return os.path.join(os.path.dirname(fn_txt), 'cache',
+                        '{}_{}'.format(base_name(fn_txt), key))
+
+
+def file_stamps(fns):
+    """(size, mtime) of each file, to tell if an index is out of date"""
+    stamps = []
+    for fn in fns:
+        st = os.stat(resolve_path(fn))
+        stamps.append([st.st_size, int(st.st_mtime * 1e6)])
+    return np.array(stamps, dtype=np.int64)
@@ -0,0 +1,240 @@
+# lookups.py
+# Lookup tables shared by the SRL and disambiguation models:
+#   frames: predicate lemma -> allowable argument labels (from frames.txt)
+#   lemma_to_preds: lemma -> predicates seen with it in a CoNLL file
+# Each table is compiled once to a small .npz file in a `cache` directory
+# next to its source, and recompiled when the source file changes.
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import numpy as np
+
+from util.files import file_stamps, base_name, open_file
+
+## Bump to invalidate compiled tables after a format change
+LOOKUP_VERSION = 1
+
+
+def encode_strings(strings):
+    ## Keys and values never contain newlines
+    return np.frombuffer('\n'.join(strings).encode('utf-8'), dtype=np.uint8)
+
+
+def decode_strings(blob):
+    if len(blob) == 0:
+        return []
+    return blob.tobytes().decode('utf-8').split('\n')
+
+
+class LookupTable(object):
+    """
+    A read-only mapping from strings to lists of strings, stored as arrays:
+    the values of keys[i] are strings[values[offsets[i]:offsets[i+1]]].
+    Supports `in`, [] and get() like the dictionaries it replaces, plus
+    vocab ids of the values for building masks.
+    """
+    def __init__(self, keys, offsets, values, strings):
+        self.keys = keys
+        self.offsets = offsets
+        self.values = values
+        self.strings = strings
+        self.key_idx = {key: i for i, key in enumerate(keys)}
+        self.encoded = {}
+
+    @classmethod
+    def from_dict(cls, d):
+        """d maps each key to a list (or other iterable) of values"""
+        strings = []
+        string_codes = {}
+        offsets = [0]
+        values = []
+        for key in d:
+            for value in d[key]:
+                code = string_codes.get(value)
+                if code is None:
+                    code = len(strings)
+                    string_codes[value] = code
+                    strings.append(value)
+                values.append(code)
+            offsets.append(len(values))
+        return cls(list(d), np.array(offsets, dtype=np.int64),
+                   np.array(values, dtype=np.int32), strings)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __contains__(self, key):
+        return key in self.key_idx
+
+    def __getitem__(self, key):
+        i = self.key_idx[key]
+        codes = self.values[self.offsets[i]:self.offsets[i + 1]]
+        return [self.strings[c] for c in codes.tolist()]
+
+    def num_values(self, key):
+        i = self.key_idx.get(key)
+        if i is None:
+            return 0
+        return int(self.offsets[i + 1] - self.offsets[i])
+
+    def get(self, key, default=None):
+        if key not in self.key_idx:
+            return default
+        return self[key]
+
+    def items(self):
+        for key in self.keys:
+            yield key, self[key]
+
+    def encode_values(self, vocab):
+        """
+        Vocab ids for every value string (words outside the vocab get its
+        unknown word, or -1 if it has none), along with whether each value
+        is in the vocab. Computed once per vocab.
+        """
+        if vocab not in self.encoded:
+            ids = vocab.encode_array(self.strings)
+            known = vocab.contains_array(self.strings)
+            self.encoded[vocab] = (ids, known)
+        return self.encoded[vocab]
+
+    def value_ids(self, key, vocab):
+        """Ids of the values of `key` that are in `vocab`"""
+        i = self.key_idx.get(key)
+        if i is None:
+            return np.zeros(0, dtype=np.int32)
+        ids, known = self.encode_values(vocab)
+        codes = self.values[self.offsets[i]:self.offsets[i + 1]]
+        return ids[codes[known[codes]]]
+
+    def masks(self, key_vocab, value_vocab, dtype=np.float32):
+        """
+        A (key_vocab.size, value_vocab.size) matrix of allowable values:
+        row i has a 1 for each value of word i of key_vocab (as encoded by
+        value_vocab, so unknown values map to its unknown word), and keys
+        that aren't in the table allow everything.
+        """
+        masks = np.ones((key_vocab.size, value_vocab.size), dtype=dtype)
+        key_rows = np.array([self.key_idx.get(key, -1) for key in
+                             key_vocab.decode_array(
+                                 np.arange(key_vocab.size)).tolist()],
+                            dtype=np.int64)
+        present = np.flatnonzero(key_rows >= 0)
+        rows = key_rows[present]
+        counts = self.offsets[rows + 1] - self.offsets[rows]
+        ## Positions of each present key's values in `values`
+        starts = np.repeat(self.offsets[rows], counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) -
+                                                     counts, counts)
+        cols = self.encode_values(value_vocab)[0][
+            self.values[starts + within]]
+        masks[present] = 0
+        rows = np.repeat(present, counts)
+        keep = cols >= 0
+        masks[rows[keep], cols[keep]] = 1
+        return masks
+
+    def save(self, fn, stamps):
+        np.savez(fn, version=np.array(LOOKUP_VERSION), stamps=stamps,
+                 keys=encode_strings(self.keys), offsets=self.offsets,
+                 values=self.values, strings=encode_strings(self.strings))
+
+    @classmethod
+    def load(cls, fn, stamps):
+        """The table in `fn`, or None if it's out of date"""
+        if not os.path.exists(fn):
+            return None
+        with np.load(fn) as data:
+            if (int(data['version']) != LOOKUP_VERSION or
+                not np.array_equal(data['stamps'], stamps)):
+                return None
+            return cls(decode_strings(data['keys']), data['offsets'],
+                       data['values'], decode_strings(data['strings']))
+
+
+def read_frames(fn):
+    """
+    Reads a frames file (one predicate and its allowable labels per line).
+    Lines for the same predicate are merged.
+    """
+    ## Dicts with None values serve as ordered sets
+    d = {}
+    with open_file(fn) as f:
+        for line in f:
+            parts = line.strip().split(' ')
+            labels = d.setdefault(parts[0], {})
+            for label in parts[1:]:
+                labels[label] = None
+    return {pred: list(labels) for pred, labels in d.items()}
+
+
+def read_lemma_to_preds(fn):
+    """
+    Maps each lemma in a CoNLL file to the predicates (e.g. elect.01)
+    that it is the lemma of, in order of first appearance.
+    """
+    d = {}
+    with open_file(fn) as f:
+        for line in f:
+            if line == '\n':
+                continue
+            parts = line.split('\t')
+            if parts[12] == 'Y':
+                d.setdefault(parts[3], {})[parts[13]] = None
+    return {lemma: list(preds) for lemma, preds in d.items()}
+
+
+def get_table_path(fn, name):
+    return os.path.join(os.path.dirname(fn), 'cache',
+                        '{}.{}.npz'.format(base_name(fn), name))
+
+
+## Tables already loaded by this process, with the stamps of their source
+_tables = {}
+
+
+def get_table(fn, name, reader):
+    """
+    The LookupTable `name` for source file `fn`, read with `reader` the
+    first time and from its compiled .npz file after that.
+    """
+    key = (os.path.abspath(fn), name)
+    stamps = file_stamps([fn])
+    if key in _tables and np.array_equal(_tables[key][0], stamps):
+        return _tables[key][1]
+    fn_table = get_table_path(fn, name)
+    table = LookupTable.load(fn_table, stamps)
+    if table is None:
+        table = LookupTable.from_dict(reader(fn))
+        table_dir = os.path.dirname(fn_table)
+        if not os.path.exists(table_dir):
+            os.makedirs(table_dir)
+        table.save(fn_table, stamps)
+    _tables[key] = (stamps, table)
+    return table
+
+
+def get_frames(language):
+    """Predicate lemma -> allowable argument labels"""
+    return get_table('data/{}/frames.txt'.format(language), 'pred_to_frame',
+                     read_frames)
+
+
+def get_lemma_table(fn):
+    """Lemma -> predicates in a CoNLL file (usually the training set)"""
+    return get_table(fn, 'lemma_to_preds', read_lemma_to_preds)
+
+
+if __name__ == '__main__':
+    # Usage: python -m util.lookups language
+    # Compiles the frames and the training set's lemma_to_preds ahead of time
+    language = sys.argv[1]
+    frames = get_frames(language)
+    lemma_to_preds = get_lemma_table(
+        'data/{}/conll09/train.txt'.format(language))
+    print('{} frames, {} lemmas'.format(len(frames), len(lemma_to_preds)))
@@ -0,0 +1,77 @@
+# normalize.py
+# Word normalization (from Marcheggiani et al), shared by the data loaders
+# and the preprocessing scripts
+import re
+
+PENN_TOKENS = {
+    '-LRB-': '(',
+    '-RRB-': ')',
+    '-LSB-': '[',
+    '-RSB-': ']',
+    '-LCB-': '{',
+    '-RCB-': '}'
+}
+
+# int() and float() can only succeed on strings that contain a digit or
+# nan/inf(inity) once commas are removed (as for float() below), so
+# anything else skips the (slow) try/except checks
+_MAYBE_NUMBER = re.compile(r'\d|nan|inf')
+
+
+def normalize_token(token):
+    """
+    Maps Penn bracket tokens to brackets, lowercases everything else, and
+    replaces integers with <NUM> and other numbers with <FLOAT>.
+    """
+    if token in PENN_TOKENS:
+        return PENN_TOKENS[token]
+
+    token = token.lower()
+    if _MAYBE_NUMBER.search(token.replace(',', '')) is None:
+        return token
+    try:
+        int(token)
+        return "<NUM>"
+    except:
+        pass
+    try:
+        float(token.replace(',', ''))
+        return "<FLOAT>"
+    except:
+        pass
+    return token
+
+
+class Normalizer(object):
+    """
+    normalize_token with a cache of results per distinct surface form.
+    The cache holds at most `max_size` forms; when it fills up it is
+    simply cleared, since frequent forms come back almost immediately.
+    """
+    def __init__(self, max_size=200000):
+        self.max_size = max_size
+        self.cache = {}
+
+    def __call__(self, token):
+        word = self.cache.get(token)
+        if word is None:
+            word = normalize_token(token)
+            if len(self.cache) >= self.max_size:
+                self.cache.clear()
+            self.cache[token] = word
+        return word
+
+    def normalize_column(self, tokens):
+        """
+        Normalizes a whole column of tokens (any sequence of strings,
+        including numpy arrays) at once, normalizing each distinct token
+        only once. Returns a list.
+        """
+        words = {token: self(token) for token in set(tokens)}
+        return [words[token] for token in tokens]
+
+
+## Shared instance
+normalizer = Normalizer()
+normalize = normalizer
+normalize_column = normalizer.normalize_column
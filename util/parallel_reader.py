@@ -0,0 +1,133 @@
+# parallel_reader.py
+# Reads a CoNLL-09 split into a Corpus with several processes: the three
+# parallel files are cut into shards at sentence boundaries (using the
+# byte offsets from util/sent_index.py), each shard is parsed in a worker,
+# and the shards are merged back together in their original order
+from __future__ import print_function
+from __future__ import division
+
+import io
+import sys
+import multiprocessing
+import numpy as np
+
+from util.corpus import Corpus, CorpusBuilder, TOKEN_FIELDS
+from util.corpus import group_sent_lines, read_corpus
+from util.sent_index import SentIndex
+from util.files import is_compressed, resolve_path
+
+## Shards per worker, so that one slow shard doesn't hold up the others
+SHARDS_PER_WORKER = 4
+
+
+def get_shards(offsets, num_shards):
+    """
+    Splits the sentences of a SentIndex into (at most) num_shards runs of
+    about the same size in bytes. Returns (start, end) byte offsets into
+    each of the three files.
+    """
+    sizes = offsets[:, 0]
+    targets = np.linspace(0, sizes[-1], num_shards + 1)
+    bounds = np.unique(np.searchsorted(sizes, targets))
+    bounds[-1] = len(offsets) - 1
+    return [(offsets[a], offsets[b]) for a, b in zip(bounds[:-1], bounds[1:])
+            if b > a]
+
+
+def read_shard(job):
+    """
+    Parses the sentences in the given byte ranges of the three files, like
+    sent_line_generator does for whole files. Returns the arrays and strings
+    of the shard (see CorpusBuilder.build_arrays).
+    """
+    fns, starts, ends = job
+    texts = []
+    for fn, start, end in zip(fns, starts, ends):
+        with open(fn, 'rb') as f:
+            f.seek(start)
+            text = f.read(end - start).decode('utf-8')
+        ## newline=None reads with universal newlines, like open(fn, 'r')
+        texts.append(io.StringIO(text, newline=None))
+    builder = CorpusBuilder()
+    for lines in group_sent_lines(*texts):
+        builder.add_sent(lines)
+    return builder.build_arrays()
+
+
+def merge_shards(shards, language='eng'):
+    """
+    Concatenates the (arrays, strings) of consecutive shards into a single
+    Corpus, re-interning the string tables and shifting the offsets.
+    """
+    strings = []
+    string_codes = {}
+    parts = {name: [] for name in TOKEN_FIELDS + ['pred_idx', 'args', 'rows']}
+    sent_offsets = [np.zeros(1, dtype=np.int64)]
+    pred_offsets = [np.zeros(1, dtype=np.int64)]
+    arg_offsets = []
+    row_offsets = [np.zeros(1, dtype=np.int64)]
+    num_tokens, num_preds, num_args, num_bytes = 0, 0, 0, 0
+    for arrays, shard_strings in shards:
+        lookup = np.zeros(len(shard_strings), dtype=np.int32)
+        for i, s in enumerate(shard_strings):
+            code = string_codes.get(s)
+            if code is None:
+                code = len(strings)
+                string_codes[s] = code
+                strings.append(s)
+            lookup[i] = code
+        for field in TOKEN_FIELDS + ['args']:
+            parts[field].append(lookup[arrays[field]])
+        parts['pred_idx'].append(arrays['pred_idx'])
+        parts['rows'].append(arrays['rows'])
+        sent_offsets.append(arrays['sent_offsets'][1:] + num_tokens)
+        pred_offsets.append(arrays['pred_offsets'][1:] + num_preds)
+        arg_offsets.append(arrays['arg_offsets'] + num_args)
+        row_offsets.append(arrays['row_offsets'][1:] + num_bytes)
+        num_tokens += len(arrays['forms'])
+        num_preds += len(arrays['pred_idx'])
+        num_args += len(arrays['args'])
+        num_bytes += len(arrays['rows'])
+
+    merged = {name: np.concatenate(part) for name, part in parts.items()}
+    merged['sent_offsets'] = np.concatenate(sent_offsets)
+    merged['pred_offsets'] = np.concatenate(pred_offsets)
+    merged['arg_offsets'] = np.concatenate(arg_offsets)
+    merged['row_offsets'] = np.concatenate(row_offsets)
+    return Corpus(merged, strings, language)
+
+
+def read_corpus_parallel(fn_txt, fn_preds, fn_stags, language='eng',
+                         num_workers=None):
+    """
+    Same result as read_corpus (sentence for sentence), parsed by
+    num_workers processes (default: one per CPU).
+    """
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    ## Compressed files can't be split at byte offsets
+    fns = [fn_txt, fn_preds, fn_stags]
+    if num_workers <= 1 or any(is_compressed(resolve_path(fn)) for fn in fns):
+        return read_corpus(fn_txt, fn_preds, fn_stags, language)
+
+    index = SentIndex(fn_txt, fn_preds, fn_stags)
+    if len(index) == 0:
+        return read_corpus(fn_txt, fn_preds, fn_stags, language)
+    jobs = [(fns, starts, ends) for starts, ends in
+            get_shards(index.offsets, num_workers * SHARDS_PER_WORKER)]
+    pool = multiprocessing.Pool(min(num_workers, len(jobs)))
+    try:
+        ## imap keeps the shards in order and lets merging start early
+        corpus = merge_shards(pool.imap(read_shard, jobs), language)
+    finally:
+        pool.close()
+        pool.join()
+    return corpus
+
+
+if __name__ == '__main__':
+    # Usage: python -m util.parallel_reader txt preds stags [num_workers]
+    num_workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    corpus = read_corpus_parallel(*sys.argv[1:4], num_workers=num_workers)
+    print('{} sentences, {} predicates'.format(corpus.num_sents,
+                                               corpus.num_preds))
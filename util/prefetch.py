@@ -0,0 +1,96 @@
+# prefetch.py
+# Builds batches in a background thread while the model runs on earlier
+# ones, so that batch construction overlaps with session.run
+from __future__ import print_function
+from __future__ import division
+
+import sys
+import time
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+## Marks the end of the items in the queue
+_END = object()
+
+
+class Prefetcher(object):
+    """
+    Iterates over `items` (e.g. a batch generator), with a worker thread
+    running up to `depth` items ahead of the consumer in a bounded queue.
+    Items come out in the same order as from `items`, and an exception
+    raised while producing them is re-raised in the consumer.
+      stall_time    seconds the consumer spent waiting for an item
+      num_stalls    how many items weren't ready when asked for
+    A Prefetcher can only be iterated over once. numpy releases the GIL for
+    most of the work of building a batch, and TensorFlow releases it during
+    session.run, so a thread is enough to hide the cost of batching.
+    """
+    def __init__(self, items, depth=2):
+        self.items = items
+        self.depth = max(depth, 1)
+        self.queue = queue.Queue(maxsize=self.depth)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.stall_time = 0.0
+        self.num_stalls = 0
+        self.num_items = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.produce)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def produce(self):
+        try:
+            for item in self.items:
+                if not self.put((item, None)):
+                    return
+        except Exception:
+            self.put((_END, sys.exc_info()))
+            return
+        self.put((_END, None))
+
+    def put(self, entry):
+        """Blocks until there is room in the queue, unless stopped"""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        self.start()
+        try:
+            while True:
+                try:
+                    item, exc_info = self.queue.get_nowait()
+                except queue.Empty:
+                    start = time.time()
+                    item, exc_info = self.queue.get()
+                    self.stall_time += time.time() - start
+                    self.num_stalls += item is not _END
+                if item is _END:
+                    break
+                self.num_items += 1
+                yield item
+        finally:
+            self.close()
+        if exc_info is not None:
+            raise exc_info[1]
+
+    def close(self):
+        """Stops the worker (e.g. if the consumer gives up early)"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __str__(self):
+        return '{} batches, waited {:.2f}s for {} of them'.format(
+            self.num_items, self.stall_time, self.num_stalls)
@@ -1,90 +1,559 @@
 # preprocess.py
-# Scripts to preprocess CoNLL data (e.g., vocabulary information)
+# Preprocesses the CoNLL-09 splits of a language for the SRL model, reading
+# each split once (the replacement for scripts/preprocess.sh):
+#   data/{lang}/conll09/gold/{split}_predicates.txt    gold predicates
+#   data/{lang}/conll09/gold/{split}_stags_model{N}.txt supertags (names)
+#   data/{lang}/stags/stags.model{N}.txt                name -> supertag
+#   data/{lang}/vocab/*.txt                             vocabs (train only,
+#                                                       labels from all)
+# Splits are cut into shards of at most MAX_SHARD_BYTES at sentence
+# boundaries (compressed ones as they are read), the shards are processed
+# by a pool of workers, and their results are put back together in order,
+# so the output doesn't depend on the number of workers. Only a few shards
+# per worker are in memory at once, however large the split.
+# The sha1 of each split and of each file written are kept in
+# data/{lang}/cache/preprocess.model{N}.json, and a split is only processed
+# again when it (or one of its outputs) has changed. Files are only
+# replaced when their contents change, so the caches built from them
+# (corpora, vocab bundles, lookup tables) stay valid. Vocabs are counted
+# with util/vocab_counter.py, which spills to disk instead of running out
+# of memory on large corpora.
+#   python -m util.preprocess eng [--num_workers 8] [--force]
 from __future__ import print_function
+from __future__ import division
 
+import io
 import os
-import sys
-import xml.etree.ElementTree as ET
-
-from collections import Counter
-from util.data_loader import conll09_generator
-from subprocess import check_output
-
-
-def get_vocab_counts(vocab_type, stag_type='ud'):
-    """
-    vocab_type must be "words", "lemmas", "pos", or "stags"
-    returns a counter
-    """
-    if vocab_type == 'labels':
-        return get_label_vocab_counts()
-    fn_txt = 'data/eng/conll09/train.txt'
-    fn_preds = 'data/eng/conll09/pred/train_predicates.txt'
-    fn_stags = 'data/eng/conll09/pred/train_stags_model1.txt'
-    counts = Counter()
-    for sent in conll09_generator(fn_txt, fn_preds, fn_stags,
-                                  only_sent=True):
-        words = getattr(sent, vocab_type)
-        counts.update(words)
-    return counts
-
-
-def get_label_vocab_counts():
-    fn_in = 'data/eng/conll09/train.txt'
-    counts = Counter()
-    with open(fn_in, 'r') as f:
-        for sent in conll09_generator(f):
-            pred_lists = sent.parent.pred_lists
-            args = [arg for pred_list in pred_lists
-                    for arg in pred_list.arg_seq]
-            counts.update(args)
-    return counts
-
-
-def preprocess_vocab(vocab_type, stag_type='ud', lan='eng'):
-    print('Getting vocab for {}...'.format(vocab_type))
-    counts = get_vocab_counts(vocab_type, stag_type)
-    if not os.path.exists('data/{}/vocab/'.format(lan)):
-        os.makedirs('data/{}/vocab/'.format(lan))
-    if vocab_type == 'stags':
-        fn_out = 'data/vocab/{}.{}.txt'.format(vocab_type, stag_type)
-    fn_out = 'data/{}/vocab/{}.txt'.format(lan, vocab_type)
-    with open(fn_out, 'w') as f_out:
-        for word, count in counts.most_common():
-            f_out.write('{} {}\n'.format(word, count))
-
-
-def get_stag_vocab_counts(stag_type='model1'):
-    fn = 'data/eng/stags/{}.txt'.format(stag_type)
-    with open(fn, 'r') as f:
-        counts = Counter(f.read().split('\n'))
-    fn_out = 'data/vocab/stags.{}.txt'.format(stag_type)
-    with open(fn_out, 'w') as f_out:
-        for word, count in counts.most_common():
-            f_out.write('{} {}\n'.format(word, count))
-            
-
-            
-            
+import re
+import glob
+import json
+import shutil
+import argparse
+import collections
+import tempfile
+import multiprocessing
+import numpy as np
+
+from util.files import open_file, is_compressed, resolve_path, base_name
+from util.files import file_hash
+from util.normalize import normalize_column
+from util.supertags import conll_line_to_dict, get_stags_from_sent
+from util.vocab_counter import VocabCounter, MAX_ENTRIES
+
+## Splits are processed in this order (then any others, by name), which
+## decides the order supertag names are handed out in
+SPLIT_ORDER = ['train', 'dev', 'test', 'ood']
+
+## Shards per worker, so that one slow shard doesn't hold up the others
+SHARDS_PER_WORKER = 4
+
+## Largest shard (of decompressed text), which bounds the memory a worker
+## needs for its part of the output
+MAX_SHARD_BYTES = 64 << 20
+
+## Shards per worker that can be queued or finished but not yet written,
+## which bounds the memory of the results waiting to be written
+SHARDS_IN_FLIGHT = 2
+
+# Bump this whenever the outputs for the same inputs change
+PREPROCESS_VERSION = 2
+
+## Vocabs that are always counted exactly and in full, since they have no
+## unk word to stand in for the words that are cut
+EXACT_VOCABS = ['labels']
+
+## Columns counted for the vocabs (0-based, as in util/supertags.py)
+FORM, PLEMMA, PPOS, PRED = 1, 3, 5, 13
+
+
+def find_splits(language):
+    """(split, file name) for each CoNLL file in data/{lang}/conll09/"""
+    fns = {}
+    pattern = 'data/{}/conll09/*.txt'.format(language)
+    for fn in glob.glob(pattern) + glob.glob(pattern + '.*'):
+        if fn.endswith('.txt') or is_compressed(fn):
+            fns.setdefault(base_name(fn), fn)
+    order = {split: i for i, split in enumerate(SPLIT_ORDER)}
+    splits = sorted(fns, key=lambda s: (order.get(s, len(order)), s))
+    return [(split, fns[split]) for split in splits]
+
+
+def get_text_shards(fn, num_shards):
+    """
+    Splits an uncompressed CoNLL file into (at most) num_shards byte ranges
+    of about the same size, each ending just after a blank line
+    """
+    size = os.path.getsize(fn)
+    bounds = [0]
+    with open(fn, 'rb') as f:
+        for k in range(1, num_shards):
+            start = max(size * k // num_shards, bounds[-1])
+            f.seek(start)
+            ## Skip to the end of the current line, then to the next blank
+            ## line
+            line = f.readline()
+            while line:
+                line = f.readline()
+                if line.strip() == b'':
+                    break
+            pos = f.tell()
+            if pos > bounds[-1] and pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def get_line_shards(fn):
+    """
+    Reads a compressed CoNLL file (which can't be read from the middle)
+    line by line, and yields its lines in shards of about MAX_SHARD_BYTES
+    of text, each ending just after a blank line
+    """
+    lines = []
+    size = 0
+    with open_file(fn) as f:
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= MAX_SHARD_BYTES and line.strip() == '':
+                yield lines
+                lines = []
+                size = 0
+    if lines:
+        yield lines
+
+
+def read_lines(fn, start, end):
+    """The lines of bytes start:end of an uncompressed file"""
+    with open(fn, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    ## newline=None reads with universal newlines, like open(fn, 'r')
+    return io.StringIO(text, newline=None).readlines()
+
+
+def cut_field(line, k):
+    """Field k of a line, like `cut -f {k+1}`"""
+    line = line.rstrip('\n')
+    parts = line.split('\t')
+    if len(parts) == 1:
+        return line
+    return parts[k] if k < len(parts) else ''
+
+
+def pred_lemma(pred):
+    """The lemma of a predicate, e.g. elect for elect.01"""
+    return re.sub(r'([a-z]*)\..*', r'\1', pred, count=1)
+
+
+def pred_lemmas(preds):
+    return [pred_lemma(pred) for pred in preds]
+
+
+class CountSettings(object):
+    """
+    How vocabs are counted (see util/vocab_counter.py): at most
+    max_entries distinct words of each vocab in memory per process,
+    spilling to spill_dir, or only the max_size most frequent words if
+    max_size is given. Words counted fewer than min_count times are left
+    out of the vocabs (except EXACT_VOCABS).
+    """
+    def __init__(self, max_entries=MAX_ENTRIES, max_size=None, min_count=1,
+                 spill_dir=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.min_count = min_count
+        self.spill_dir = spill_dir
+
+    def counter(self, name, transform=None):
+        max_size = None if name in EXACT_VOCABS else self.max_size
+        return VocabCounter(self.max_entries, max_size, self.spill_dir,
+                            transform)
+
+    def get_min_count(self, name):
+        return 1 if name in EXACT_VOCABS else self.min_count
+
+    def meta(self):
+        """The settings that change the vocabs"""
+        return {'max_size': self.max_size, 'min_count': self.min_count}
+
+
+def process_shard(job):
+    """
+    Reads a shard of a split and returns
+      preds         the text of its gold predicates file
+      stags         the distinct supertags, in order of first appearance
+      stag_codes    index into `stags` of each token's supertag
+      sent_lengths  the number of tokens in each sentence
+      counts        VocabCounters of the labels, and of the other vocabs
+                    if counting (words, pos, plemmas, predicates and
+                    lemmas)
+    As in scripts/extract.py, a sentence only gets supertags once the
+    blank line that ends it is read.
+    """
+    fn, shard, stag_model, settings, count = job
+    pred_lines = []
+    stags = {}
+    stag_codes = []
+    sent_lengths = []
+    counts = {'labels': settings.counter('labels')}
+    if count:
+        counts.update((name, settings.counter(name)) for name in
+                      ['pos', 'plemmas', 'predicates'])
+        counts['words'] = settings.counter('words', normalize_column)
+        counts['lemmas'] = settings.counter('lemmas', pred_lemmas)
+    sent = []
+    ## A shard is a byte range of fn, or the lines themselves
+    lines = read_lines(fn, *shard) if isinstance(shard, tuple) else shard
+    for line in lines:
+        pred_lines.append(cut_field(line, PRED))
+        line = line.strip()
+        if len(line) > 0:
+            sent.append(line)
+            continue
+        words = [conll_line_to_dict(l) for l in sent]
+        for stag in get_stags_from_sent(words, stag_model):
+            stag_codes.append(stags.setdefault(stag, len(stags)))
+        sent_lengths.append(len(sent))
+        rows = [l.split('\t') for l in sent]
+        counts['labels'].update(label for row in rows
+                                for label in row[PRED + 1:]
+                                if label.strip())
+        if count:
+            preds = [row[PRED] for row in rows if len(row) > PRED]
+            counts['words'].update(row[FORM] for row in rows)
+            counts['pos'].update(row[PPOS] for row in rows)
+            counts['plemmas'].update(row[PLEMMA] for row in rows)
+            counts['predicates'].update(preds)
+            counts['lemmas'].update(preds)
+        sent = []
+    preds = ''.join(p + '\n' for p in pred_lines)
+    return (preds, list(stags), np.array(stag_codes, dtype=np.int32),
+            np.array(sent_lengths, dtype=np.int64), counts)
+
+
+def stag_text(names, sent_lengths):
+    """The lines of a supertag file, for token names and sentence lengths"""
+    lines = []
+    start = 0
+    for length in sent_lengths.tolist():
+        lines.extend(names[start:start + length])
+        lines.append('')
+        start += length
+    return ''.join(line + '\n' for line in lines)
+
+
+def imap_window(pool, func, jobs, window):
+    """
+    Like pool.imap, but only takes the next job once fewer than `window`
+    jobs are running or waiting to be collected, so that finished results
+    (and the jobs themselves) don't pile up in memory
+    """
+    if pool is None:
+        for job in jobs:
+            yield func(job)
+        return
+    running = collections.deque()
+    for job in jobs:
+        running.append(pool.apply_async(func, (job,)))
+        if len(running) >= window:
+            yield running.popleft().get()
+    while running:
+        yield running.popleft().get()
+
+
+def merge_counts(total, counts):
+    for name, counter in counts.items():
+        if name in total:
+            total[name].merge(counter)
+        else:
+            total[name] = counter
+
+
+def write_vocab(fn, counter, min_count=1):
+    """
+    Writes the 'word count' lines of a VocabCounter, most frequent first,
+    like
+      sort | uniq -c | sort -bnr
+    in the C locale (ties in reverse order of the words)
+    """
+    with open_file(fn, 'w') as f:
+        for word, count in counter.most_common(min_count):
+            f.write('{} {}\n'.format(word, count))
+
+
+def ensure_dir(fn):
+    dirname = os.path.dirname(fn)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+
+def tmp_path(fn):
+    return '{}.tmp{}'.format(fn, os.getpid())
+
+
+def replace_if_changed(fn_tmp, fn):
+    """
+    Moves a newly written file over fn, unless fn already has the same
+    contents (so its mtime is kept). Returns the sha1 of the contents.
+    """
+    new_hash = file_hash(fn_tmp)
+    if os.path.exists(fn) and file_hash(fn) == new_hash:
+        os.remove(fn_tmp)
+    else:
+        os.rename(fn_tmp, fn)
+    return new_hash
+
+
+def outputs_fresh(outputs):
+    """Whether every file in `outputs` (file name -> sha1) is unchanged"""
+    return all(os.path.exists(fn) and file_hash(fn) == h
+               for fn, h in outputs.items())
+
+
+def get_manifest_path(language, stag_model=1):
+    return 'data/{}/cache/preprocess.model{}.json'.format(language,
+                                                          stag_model)
+
+
+def new_manifest(stag_model=1):
+    return {'version': PREPROCESS_VERSION, 'stag_model': stag_model,
+            'splits': {}, 'vocabs': {}, 'stag_names': {}, 'labels': {}}
+
+
+def load_manifest(fn, stag_model=1):
+    """
+    The record of the last run: the sha1 of each split's source and of the
+    files written for it ('splits'), of the train split the vocabs were
+    counted from ('vocabs'), of the supertag names and of the labels vocab,
+    with the label counts of each split. Empty if missing or written by
+    another version.
+    """
+    manifest = new_manifest(stag_model)
+    if os.path.exists(fn):
+        with open(fn, 'r') as f:
+            old = json.load(f)
+        if (old.get('version') == PREPROCESS_VERSION and
+                old.get('stag_model') == stag_model):
+            manifest = old
+    return manifest
+
+
+def save_manifest(fn, manifest):
+    ensure_dir(fn)
+    with open(fn + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(fn + '.tmp', fn)
+
+
+def read_stag_names(fn):
+    """stag -> index, from a 'name stag' file written by preprocess"""
+    stag_names = {}
+    with open_file(fn) as f:
+        for line in f:
+            name, stag = line.rstrip('\n').split(' ', 1)
+            stag_names[stag] = int(name[1:])
+    return stag_names
+
+
+def preprocess_split(fn, split, language, stag_names, stag_model=1,
+                     settings=None, count=False, pool=None, num_workers=1):
+    """
+    Writes the gold predicates and supertags of one split, giving new
+    supertags the next names in `stag_names` (stag -> index). Returns the
+    VocabCounters of the split, as set by `settings` (CountSettings): the
+    labels, and if counting the other vocabs too (with the supertag names
+    in 'stags'). Returns the sha1 of each file written too.
+    """
+    fn = resolve_path(fn)
+    if is_compressed(fn):
+        shards = get_line_shards(fn)
+    else:
+        num_shards = max(num_workers * SHARDS_PER_WORKER if pool else 1,
+                         -(-os.path.getsize(fn) // MAX_SHARD_BYTES))
+        shards = get_text_shards(fn, num_shards)
+    jobs = ((fn, shard, stag_model, settings, count) for shard in shards)
+    ## Results come back in order, and writing starts with the first
+    results = imap_window(pool, process_shard, jobs,
+                          num_workers * SHARDS_IN_FLIGHT)
+    gold_dir = 'data/{}/conll09/gold'.format(language)
+    fn_preds = os.path.join(gold_dir, '{}_predicates.txt'.format(split))
+    fn_stags = os.path.join(gold_dir, '{}_stags_model{}.txt'.format(
+        split, stag_model))
+    ensure_dir(fn_preds)
+    counts = {}
+    if count:
+        counts['stags'] = settings.counter('stags')
+    with open_file(tmp_path(fn_preds), 'w') as f_preds, \
+         open_file(tmp_path(fn_stags), 'w') as f_stags:
+        for preds, stags, stag_codes, sent_lengths, shard_counts in results:
+            f_preds.write(preds)
+            lookup = np.array([stag_names.setdefault(s, len(stag_names))
+                               for s in stags], dtype=np.int32)
+            codes = lookup[stag_codes]
+            names = ['s{}'.format(c) for c in codes.tolist()]
+            f_stags.write(stag_text(names, sent_lengths))
+            merge_counts(counts, shard_counts)
+            if count:
+                counts['stags'].update(names)
+    outputs = {fn: replace_if_changed(tmp_path(fn), fn)
+               for fn in [fn_preds, fn_stags]}
+    return counts, outputs
+
+
+def preprocess(language, stag_model=1, num_workers=None, train='train',
+               force=False, settings=None, train_labels=False):
+    """
+    Preprocesses every split of a language (see the top of this file).
+    Vocabs are counted from the `train` split, as set by `settings`
+    (CountSettings), except the labels, which are counted over every split
+    (as the labels vocab has no unk) unless `train_labels`. Splits that
+    haven't changed since the last run are skipped, unless `force`.
+    """
+    if settings is None:
+        settings = CountSettings()
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    splits = find_splits(language)
+    if train not in [split for split, _ in splits]:
+        raise ValueError('No {} split in data/{}/conll09/'.format(
+            train, language))
+    fn_manifest = get_manifest_path(language, stag_model)
+    fn_names = 'data/{}/stags/stags.model{}.txt'.format(language, stag_model)
+    manifest = load_manifest(fn_manifest, stag_model)
+    ## Supertag names are only ever added to, so that the supertag files of
+    ## splits that are skipped keep their meaning. If the names can't be
+    ## trusted, everything is processed again.
+    stag_names = {}
+    if (force or not manifest['stag_names'] or
+            not outputs_fresh(manifest['stag_names'])):
+        manifest = new_manifest(stag_model)
+    else:
+        stag_names = read_stag_names(fn_names)
+
+    old_splits = manifest['splits']
+    manifest['splits'] = {}
+    num_stags = len(stag_names)
+    pool = None
+    spill_dir = None
+    if settings.spill_dir is None:
+        ## Spill next to the data rather than to a small /tmp
+        cache_dir = 'data/{}/cache'.format(language)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        spill_dir = settings.spill_dir = tempfile.mkdtemp(
+            prefix='vocab_counts.', dir=cache_dir)
+    try:
+        for split, fn in splits:
+            source = file_hash(fn)
+            entry = old_splits.get(split, {})
+            fresh = (entry.get('source') == source and
+                     outputs_fresh(entry['outputs']))
+            if split == train:
+                vocabs = manifest['vocabs']
+                fresh = (fresh and vocabs.get('source') == source and
+                         vocabs.get('settings') == settings.meta() and
+                         outputs_fresh(vocabs['outputs']))
+            if fresh:
+                print('{} is up to date'.format(fn))
+                manifest['splits'][split] = entry
+                continue
+            print('Preprocessing {}...'.format(fn))
+            if pool is None and num_workers > 1:
+                pool = multiprocessing.Pool(num_workers)
+            counts, outputs = preprocess_split(
+                fn, split, language, stag_names, stag_model, settings,
+                count=split == train, pool=pool, num_workers=num_workers)
+            ## The label counts of each split are kept, so that the labels
+            ## vocab can be put together without reading skipped splits
+            labels = counts.pop('labels')
+            manifest['splits'][split] = {'source': source, 'outputs': outputs,
+                                         'labels': dict(labels.items())}
+            if split == train:
+                manifest['vocabs'] = {
+                    'source': source,
+                    'settings': settings.meta(),
+                    'outputs': write_vocabs(language, counts, stag_model,
+                                            settings)
+                }
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+            settings.spill_dir = None
+
+    ensure_dir(fn_names)
+    with open(tmp_path(fn_names), 'w') as f:
+        for stag, i in sorted(stag_names.items(), key=lambda x: x[1]):
+            f.write('s{} {}\n'.format(i, stag))
+    manifest['stag_names'] = {fn_names: replace_if_changed(tmp_path(fn_names),
+                                                           fn_names)}
+    print('{} supertags ({} new)'.format(len(stag_names),
+                                         len(stag_names) - num_stags))
+
+    labels = settings.counter('labels')
+    for split, entry in sorted(manifest['splits'].items()):
+        if split == train or not train_labels:
+            labels.update(entry['labels'])
+    fn_labels = 'data/{}/vocab/labels.txt'.format(language)
+    write_vocab(tmp_path(fn_labels), labels)
+    manifest['labels'] = {fn_labels: replace_if_changed(tmp_path(fn_labels),
+                                                        fn_labels)}
+    save_manifest(fn_manifest, manifest)
+
+
+def write_vocabs(language, counts, stag_model, settings):
+    """Writes data/{lang}/vocab/*.txt, returning the sha1 of each file"""
+    outputs = {}
+    for name, counter in counts.items():
+        fn_vocab = 'data/{}/vocab/{}.txt'.format(language, name)
+        if name == 'stags':
+            fn_vocab = 'data/{}/vocab/stags.model{}.txt'.format(language,
+                                                               stag_model)
+        ensure_dir(fn_vocab)
+        write_vocab(tmp_path(fn_vocab), counter,
+                    settings.get_min_count(name))
+        outputs[fn_vocab] = replace_if_changed(tmp_path(fn_vocab), fn_vocab)
+    print('Wrote {} vocabs to data/{}/vocab/'.format(len(counts), language))
+    return outputs
+
+
 if __name__ == '__main__':
-    # vocab_types = ['words', 'lemmas', 'pos', 'labels', 'stags']
-    vocab_types = ['lemmas']
-    for vocab_type in vocab_types:
-        preprocess_vocab(vocab_type, 'zh')
-
-    # fns = ['train', 'dev', 'test', 'ood']
-    # for fn in fns:
-    #     print(fn + ':')
-        
-    #     print('Getting stags...')        
-    #     fn_pred = 'data/conll09/pred/{}.tag'.format(fn)
-    #     stag_sents = get_stags(fn_pred)
-
-    #     print('Writing to file...')
-    #     fn_in = 'data/conll09/gold/{}.txt'.format(fn)
-    #     fn_out = 'data/conll09/gold/{}.tag'.format(fn)
-    #     add_stags(fn_in, fn_out, stag_sents)
-
-    # get_stag_vocab_counts('model2')
-    #preprocess_vocab('words')
-    
+    parser = argparse.ArgumentParser(
+        description='Extract predicates, supertags and vocabs from the '
+                    'CoNLL-09 splits of a language')
+    parser.add_argument('language', help='Language of the data, e.g. eng')
+    parser.add_argument('--num_workers', type=int, default=None,
+                        help='Number of processes (default: one per CPU)')
+    parser.add_argument('--stag_model', type=int, default=1,
+                        help='Supertag model (0, 1 or 2, see '
+                             'util/supertags.py)')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='Process every split, even if up to date')
+    parser.add_argument('--max_vocab_entries', type=int, default=MAX_ENTRIES,
+                        help='Distinct words of a vocab each process counts '
+                             'in memory before spilling to disk')
+    parser.add_argument('--max_vocab_size', type=int, default=None,
+                        help='Count approximately, keeping only this many '
+                             'of the most frequent words of each vocab')
+    parser.add_argument('--train_labels', action='store_true',
+                        default=False,
+                        help='Count the labels vocab from the train split '
+                             'only (as scripts/preprocess.sh used to)')
+    parser.add_argument('--min_count', type=int, default=1,
+                        help='Leave words counted fewer times out of the '
+                             'vocabs')
+    args = parser.parse_args()
+    preprocess(args.language, args.stag_model, args.num_workers,
+               force=args.force, settings=CountSettings(
+                   args.max_vocab_entries, args.max_vocab_size,
+                   args.min_count), train_labels=args.train_labels)
+
+    from util.lookups import get_frames, get_lemma_table
+    print('Compiling lookup tables...')
+    get_lemma_table('data/{}/conll09/train.txt'.format(args.language))
+    if os.path.exists(resolve_path(
+            'data/{}/frames.txt'.format(args.language))):
+        get_frames(args.language)
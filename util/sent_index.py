@@ -0,0 +1,138 @@
+# sent_index.py
+# Byte-offset index over a CoNLL-09 split (text, predicates and supertags),
+# for reading individual sentences without streaming the whole file
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import numpy as np
+
+from util.conll_io import CoNLL09_Sent
+from util.corpus import CorpusBuilder, split_line
+from util.files import get_cache_dir, file_stamps
+from util.files import is_compressed, resolve_path
+
+
+def get_index_path(fn_txt, fn_preds, fn_stags):
+    """The index is stored next to the corpus cache for the same files"""
+    return get_cache_dir(fn_txt, fn_preds, fn_stags) + '.index.npz'
+
+
+def build_sent_index(fn_txt, fn_preds, fn_stags):
+    """
+    Returns an int64 array `offsets` shaped (num_sents + 1, 3): sentence i
+    is bytes offsets[i, k]:offsets[i+1, k] of file k (including the blank
+    line that ends it). Like conll09_generator, only sentences that end in
+    a blank line of the text file are counted (conll09_generator reads in
+    text mode, so blank lines with CRLF endings count too).
+    """
+    fs = [open(fn, 'rb') for fn in [fn_txt, fn_preds, fn_stags]]
+    pos_txt, pos_preds, pos_stags = 0, 0, 0
+    offsets = [(0, 0, 0)]
+    for line, pred, stag in zip(*fs):
+        pos_txt += len(line)
+        pos_preds += len(pred)
+        pos_stags += len(stag)
+        if line == b'\n' or line == b'\r\n':
+            offsets.append((pos_txt, pos_preds, pos_stags))
+    [f.close() for f in fs]
+    return np.array(offsets, dtype=np.int64)
+
+
+class SentIndex(object):
+    """
+    Random access to the sentences of three parallel CoNLL-09 files.
+    The index is built on first use and rebuilt whenever one of the files
+    changes size or modification time.
+      index.sent_lines(i)     the lines of sentence i (as in CorpusBuilder)
+      index.sents(idxs)       CoNLL09_Sent objects for a list of indices
+      index.corpus(idxs)      a Corpus of just those sentences
+    Each sentence costs one seek and one read per file.
+    """
+    def __init__(self, fn_txt, fn_preds, fn_stags, fn_index=None):
+        self.fns = [resolve_path(fn) for fn in [fn_txt, fn_preds, fn_stags]]
+        for fn in self.fns:
+            if is_compressed(fn):
+                raise ValueError('{} is compressed, so it can only be read '
+                                 'sequentially'.format(fn))
+        if fn_index is None:
+            fn_index = get_index_path(fn_txt, fn_preds, fn_stags)
+        self.fn_index = fn_index
+
+        stamps = file_stamps(self.fns)
+        self.offsets = None
+        if os.path.exists(fn_index):
+            with np.load(fn_index) as data:
+                if np.array_equal(data['stamps'], stamps):
+                    self.offsets = data['offsets']
+        if self.offsets is None:
+            self.offsets = build_sent_index(*self.fns)
+            index_dir = os.path.dirname(fn_index)
+            if index_dir and not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+            np.savez(fn_index, offsets=self.offsets, stamps=stamps)
+        self.files = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def open(self):
+        if self.files is None:
+            self.files = [open(fn, 'rb') for fn in self.fns]
+
+    def close(self):
+        if self.files is not None:
+            [f.close() for f in self.files]
+            self.files = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_raw(self, i):
+        """The raw text of sentence i in each of the three files"""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('sentence {} out of range'.format(i))
+        self.open()
+        texts = []
+        for k, f in enumerate(self.files):
+            start, end = self.offsets[i, k], self.offsets[i + 1, k]
+            f.seek(start)
+            texts.append(f.read(end - start).decode('utf-8'))
+        return texts
+
+    def sent_lines(self, i):
+        txt, preds, stags = [text.split('\n')[:-2]
+                             for text in self.read_raw(i)]
+        return [split_line(line, pred, stag)
+                for line, pred, stag in zip(txt, preds, stags)]
+
+    def sents(self, idxs):
+        return [CoNLL09_Sent(self.sent_lines(i)) for i in idxs]
+
+    def corpus(self, idxs, language='eng'):
+        builder = CorpusBuilder()
+        for i in idxs:
+            builder.add_sent(self.sent_lines(i))
+        return builder.build(language)
+
+    def sample(self, n, seed=None):
+        """Sorted indices of n randomly chosen sentences"""
+        rng = np.random.RandomState(seed)
+        n = min(n, len(self))
+        return np.sort(rng.choice(len(self), n, replace=False)).tolist()
+
+
+if __name__ == '__main__':
+    # Usage: python -m util.sent_index txt preds stags [sentence_idx ...]
+    index = SentIndex(*sys.argv[1:4])
+    print('{} sentences indexed in {}'.format(len(index), index.fn_index))
+    for i in sys.argv[4:]:
+        print(index.sents([int(i)])[0])
+    index.close()
@@ -0,0 +1,127 @@
+# supertags.py
+# Extracts the dependency tree supertags of Ouchi et al. 2014 from
+# CoNLL-format sentences (used by scripts/extract.py and util/preprocess.py)
+from __future__ import print_function
+
+from collections import defaultdict
+
+
+def conll_line_to_dict(line):
+    '''
+    Stores a CoNLL word in named fields for more transparent access.
+    `line` should be a string.
+    ConLL-09:
+        0:ID    1:FORM   2:LEMMA   3:PLEMMA    4:POS        5:PPOS
+        6:FEAT  7:PFEAT  8:HEAD    9:PHEAD     10:DEPREL     11:PDEPREL
+        12:FILLPRED      13:PRED   14:APRED1   15:APRED2    ...
+    '''
+    fields = [(0, 'idx', int), (4, 'pos', str),
+              (8, 'head', int), (10, 'deprel', str)]
+    # fields = [(0, 'idx', int), (3, 'pos', str),
+    #           (6, 'head', int), (7, 'deprel', str)]
+    
+    parts = line.split('\t')
+    d = {}
+    for idx, field, dtype in fields:
+        d[field] = dtype(parts[idx])
+    return d
+
+
+def get_model0_stag(word, dep_table):
+    # This is the model from Foth et al. (2006).
+    # The template is:
+    #   [left_dependents]+DEPREL/DIRECTION+[right_dependents]
+    # left_dependents and right_dependents are comma-separated lists of
+    # the deprels of dependents.
+    # DIRECTION is the direction (L or R) to the head, or N if it's the root.
+    head = word['deprel']
+    if word['deprel'] == 'ROOT':
+        head += '/N'
+    else:
+        head += '/R' if word['head'] > word['idx'] else '/L'
+    l_deps = [w['deprel'] for w in dep_table[word['idx']]['L']]
+    r_deps = [w['deprel'] for w in dep_table[word['idx']]['R']]
+    stag = '+'.join([','.join(l_deps), head, ','.join(r_deps)])
+    return stag
+
+
+def get_model1_stag(word, dep_table):
+    # In model 1, the template is
+    #   DEPREL/DIRECTION+L_R,
+    # DIRECTION is direction (L or R) to head.
+    # The L and R after the + sign are binary features indicating whether or
+    # not the word has any dependents to the left or right.
+    head = word['deprel']
+    if word['deprel'] != 'ROOT':
+        head += '/R' if word['head'] > word['idx'] else '/L'
+    deps = []
+    if len(dep_table[word['idx']]['L']) > 0:
+        deps.append('L')
+    if len(dep_table[word['idx']]['R']) > 0:
+        deps.append('R')
+    if len(deps) > 0:
+        stag = head + '+' + '_'.join(deps)
+    else:
+        stag = head
+    return stag
+
+
+def get_model2_stag(word, dep_table):
+    # Model 2 is the same as model 1, only verbs are additionally labeled
+    # with their obligatory arguments (any argument labeled SBJ, OBJ, PRD,
+    # or VC). If a verb has only non-obligatory arguments, the supertag
+    # just indicates the direction, like in model1.
+    
+    arg_list = ['SBJ', 'OBJ', 'PRD', 'VC']
+    # arg_list = ['nsubj', 'csubj', 'dobj', 'iobj', 'ccomp', 'xcomp']
+    
+    if word['pos'][0] != 'V':
+        return get_model1_stag(word, dep_table)
+
+    head = word['deprel']
+    if word['deprel'] != 'ROOT':
+        head += '/R' if word['head'] > word['idx'] else '/L'
+        
+
+    l_deps = [w['deprel'] + '/L' for w in dep_table[word['idx']]['L']
+              if w['deprel'] in arg_list]
+    r_deps = [w['deprel'] + '/R' for w in dep_table[word['idx']]['R']
+              if w['deprel'] in arg_list]
+    
+    if len(dep_table[word['idx']]['L']) > 0 and len(l_deps) == 0:
+        l_deps.append('L')
+    if len(dep_table[word['idx']]['R']) > 0 and len(r_deps) == 0:
+        r_deps.append('R')
+        
+    deps = l_deps + r_deps
+    if len(deps) > 0:
+        stag = head + '+' + '_'.join(deps)
+    else:
+        stag = head
+    return stag
+
+
+
+def get_stags_from_sent(words, model_number):
+    '''
+    Given a conll sentence, returns a list of supertags.
+    `words` should be a list of conll word dicts.
+    `model_number` should be 0, 1, or 2:
+      0 is the model from Foth et al (2006);
+      1 and 2 are from Ouchi et al.
+    '''
+
+    # Build an adjacency matrix for left and right dependencies
+    dep_table = defaultdict(lambda: defaultdict(list))
+    for i, word in enumerate(words):
+        if words[word['head'] - 1]['idx'] > word['idx']:
+            dep_table[word['head']]['L'].append(word)
+        else:
+            dep_table[word['head']]['R'].append(word)
+
+    # Get the stags according to the model number
+    get_stag_fns = [get_model0_stag, get_model1_stag, get_model2_stag]
+    get_stag = get_stag_fns[model_number]
+    stags = [get_stag(word, dep_table) for word in words]
+
+    return stags
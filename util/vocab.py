@@ -1,11 +1,31 @@
 # vocab.py
 # A class for storing vocabulary information and encoding words as integers
+# The vocabs of a language and supertag type are compiled once into a
+# binary bundle in data/{lang}/vocab/cache/, which later runs memory-map
+# instead of parsing the text files (see get_vocabs)
 from __future__ import print_function
 from __future__ import division
 
+import os
+import sys
+import json
+import hashlib
 import numpy as np
 from collections import Counter
 
+from util.files import open_file, file_hash
+
+## Bump to invalidate compiled vocab bundles after a format change
+BUNDLE_VERSION = 1
+BUNDLE_MAGIC = b'SRLVOCAB'
+## Arrays in a bundle start at multiples of this many bytes
+BUNDLE_ALIGN = 64
+
+VOCAB_TYPES = ['words', 'pos', 'lemmas', 'plemmas',
+               'labels', 'stags', 'predicates']
+## Arrays of a Vocab that are stored in a bundle
+BUNDLE_ARRAYS = ['words', 'word_counts', 'sorted_idxs', 'sorted_words']
+
 class Vocab(object):
     def __init__(self, fn, zero=None, unk=None, alpha=0.25):
         """
@@ -16,37 +36,128 @@ class Vocab(object):
         If zero is provided, index 0 is reserved for zero.
         If unk is provided, unk is added to vocab.
         alpha is an optional hyperparameter for word dropout.
+        `version` is a hash of the vocab file and the zero/unk settings,
+          so that caches of encoded data can tell if the ids changed.
+        The vocab is stored as arrays:
+          words: the word of each index
+          word_counts: the count of each index's word in the file (0 for
+            words that aren't in it, e.g. usually unk)
+          sorted_words, sorted_idxs: the words in sorted order and their
+            indices, to look words up with a binary search
+        encode_array, decode_array and freqs_array work on whole arrays of
+        words or indices at once; the other methods are wrappers around
+        them (or the dictionaries built from them on first use).
         """
         self.zero = zero
         self.unk = unk
         self.alpha = alpha
 
-        with open(fn, 'r') as f:
+        with open_file(fn) as f:
             lines = f.readlines()
+        version = hashlib.md5('{} {}\n'.format(zero, unk).encode('utf-8'))
+        version.update(''.join(lines).encode('utf-8'))
+        self.version = version.hexdigest()
         counts = [line.strip().split(' ') for line in lines]
-        self.counts = {w: int(c) for w, c in counts}
-        
-        if self.zero is not None:
-            self.idx_to_word = {}
-            self.idx_to_word[0] = self.zero
-            for w, _ in counts:
-                if w != self.zero:
-                    self.idx_to_word[len(self.idx_to_word)] = w
-        else:
-            self.idx_to_word = {i: w for i, (w, _) in
-                                enumerate(counts, start=0)}
 
+        ## Counts go by word, so a repeated word has the count of its last
+        ## line, and zero and unk only have counts if they're in the file
+        file_counts = {w: int(c) for w, c in counts}
+        words = [w for w, _ in counts]
+        if self.zero is not None:
+            words = [self.zero] + [w for w in words if w != self.zero]
         if self.unk is not None:
-            self.idx_to_word[len(self.idx_to_word)] = self.unk
+            words.append(self.unk)
+        self.set_arrays(np.array(words, dtype=str), np.array(
+            [file_counts.get(w, 0) for w in words], dtype=np.int64))
 
-        self.word_to_idx = {w: i for i, w in self.idx_to_word.items()}
+    @classmethod
+    def from_arrays(cls, words, word_counts, zero=None, unk=None,
+                    version=None, alpha=0.25, sorted_idxs=None,
+                    sorted_words=None):
+        """
+        A Vocab made straight from its arrays (e.g. memory-mapped from a
+        bundle), without a vocab file
+        """
+        vocab = cls.__new__(cls)
+        vocab.zero = zero
+        vocab.unk = unk
+        vocab.alpha = alpha
+        vocab.version = version
+        vocab.set_arrays(words, word_counts, sorted_idxs, sorted_words)
+        return vocab
+
+    def set_arrays(self, words, word_counts, sorted_idxs=None,
+                   sorted_words=None):
+        self.words = words
+        self.word_counts = word_counts
+        self.size = len(words)
+        ## A stable sort keeps repeated words in index order, so the last
+        ## one is found (and wins, as in a dict)
+        if sorted_idxs is None:
+            sorted_idxs = np.argsort(words, kind='mergesort')
+            sorted_words = words[sorted_idxs]
+        self.sorted_idxs = sorted_idxs
+        self.sorted_words = sorted_words
+        self._idx_to_word = None
+        self._word_to_idx = None
+        self._counts = None
         if self.unk is not None:
-            self.unk_idx = self.word_to_idx[self.unk]
+            self.unk_idx = int(self.find([self.unk])[0])
         else:
             self.unk_idx = -1
 
-        self.size = len(self.idx_to_word)
+    def find(self, words):
+        """The index of each word, or -1 for words not in the vocab"""
+        words = np.asarray(words, dtype=str)
+        if self.size == 0:
+            return np.full(words.shape, -1, dtype=np.int32)
+        pos = np.searchsorted(self.sorted_words, words, side='right') - 1
+        found = self.sorted_words[np.maximum(pos, 0)] == words
+        found &= pos >= 0
+        return np.where(found, self.sorted_idxs[np.maximum(pos, 0)],
+                        -1).astype(np.int32)
+
+    def contains_array(self, words):
+        """Whether each word is in the vocab"""
+        return self.find(words) >= 0
+
+    def encode_array(self, words):
+        """
+        Ids of an array of words. Words not in the vocab get unk_idx (-1
+        if there is no unk word).
+        """
+        idxs = self.find(words)
+        idxs[idxs < 0] = self.unk_idx
+        return idxs
+
+    def decode_array(self, idxs):
+        """The words of an array of ids"""
+        return self.words[np.asarray(idxs, dtype=np.int64)]
+
+    def freqs_array(self, words):
+        """The count of each word in the vocab file (0 if it's not there)"""
+        idxs = self.find(words)
+        return np.where(idxs >= 0, self.word_counts[idxs], 0)
 
+    @property
+    def idx_to_word(self):
+        if self._idx_to_word is None:
+            self._idx_to_word = dict(enumerate(self.words.tolist()))
+        return self._idx_to_word
+
+    @property
+    def word_to_idx(self):
+        if self._word_to_idx is None:
+            self._word_to_idx = {w: i for i, w in
+                                 enumerate(self.words.tolist())}
+        return self._word_to_idx
+
+    @property
+    def counts(self):
+        if self._counts is None:
+            self._counts = dict(zip(self.words.tolist(),
+                                    self.word_counts.tolist()))
+        return self._counts
 
     def encode(self, word, use_dropout=False):
         """
@@ -54,61 +165,174 @@ class Vocab(object):
         Optionally applies word dropout
           (see Marcheggiani et al, 2017, section 3)
         """
-        if word not in self.word_to_idx:
+        idx = self.word_to_idx.get(word)
+        if idx is None:
             if self.unk is None:
                 raise KeyError("{} not found".format(word))
-            word = self.unk
+            idx = self.unk_idx
         # if use_dropout and word != self.unk:
         #     drop_prob = self.alpha / (self.counts[word] + self.alpha)
         #     if np.random.random() < drop_prob:
         #         word = self.unk
-        return self.word_to_idx[word]
+        return idx
 
     def get_freqs(self, words):
-        freqs = []
-        for word in words:
-            if word in self.counts:
-                freqs.append(self.counts[word])
-            else:
-                freqs.append(0)
-        return freqs
+        return self.freqs_array(list(words)).tolist()
 
     def encode_sequence(self, words, use_dropout=False):
-        return [self.encode(word, use_dropout) for word in words]
+        return [self.encode(word) for word in words]
 
     def decode(self, idx):
         return self.idx_to_word[idx]
 
     def decode_sequence(self, idxs):
-        return [self.decode(idx) for idx in idxs]
+        return self.decode_array(list(idxs)).tolist()
 
     def __contains__(self, word):
         return word in self.word_to_idx
 
 
     
+def vocab_settings(vocab_type):
+    """The zero and unk words of a type of vocab"""
+    if vocab_type == 'labels':
+        return None, None
+    elif vocab_type == 'lemmas' or vocab_type == 'predicates':
+        return '_', '<unk>'
+    else:
+        return '<zero>', '<unk>'
+
+
+def get_vocab_path(language, stag_type, vocab_type):
+    if vocab_type == 'stags':
+        return 'data/{}/vocab/stags.{}.txt'.format(language, stag_type)
+    return 'data/{}/vocab/{}.txt'.format(language, vocab_type)
+
+
+def read_vocabs(language='eng', stag_type='ud'):
+    """get_vocabs, straight from the text files"""
+    vocabs = {}
+    for vocab_type in VOCAB_TYPES:
+        zero, unk = vocab_settings(vocab_type)
+        vocabs[vocab_type] = Vocab(
+            get_vocab_path(language, stag_type, vocab_type),
+            zero=zero, unk=unk)
+    return vocabs
+
+
+def get_bundle_path(language, stag_type):
+    return 'data/{}/vocab/cache/vocabs.{}.bin'.format(language, stag_type)
+
+
+def get_bundle_meta(language, stag_type):
+    """The metadata a bundle must match to be up to date"""
+    return {
+        'version': BUNDLE_VERSION,
+        'sources': {t: file_hash(get_vocab_path(language, stag_type, t))
+                    for t in VOCAB_TYPES},
+        'settings': {t: list(vocab_settings(t)) for t in VOCAB_TYPES}
+    }
+
+
+def save_vocab_bundle(fn, vocabs, meta):
+    """
+    Writes `vocabs` to a single file: BUNDLE_MAGIC, the length of a JSON
+    header (as a little-endian uint64), the header, and then the arrays of
+    every vocab (see BUNDLE_ARRAYS), each at an offset given in the header
+    and aligned so that they can be memory-mapped in place. Words are
+    stored as fixed-width unicode arrays, like Vocab.words.
+    """
+    layout = {}
+    arrays = []
+    size = 0
+    for vocab_type, vocab in sorted(vocabs.items()):
+        entry = {'zero': vocab.zero, 'unk': vocab.unk,
+                 'version': vocab.version, 'arrays': {}}
+        for name in BUNDLE_ARRAYS:
+            array = np.ascontiguousarray(getattr(vocab, name))
+            entry['arrays'][name] = [size, array.dtype.str,
+                                     list(array.shape)]
+            arrays.append((size, array))
+            size += -(-array.nbytes // BUNDLE_ALIGN) * BUNDLE_ALIGN
+        layout[vocab_type] = entry
+    header = json.dumps({'meta': meta, 'vocabs': layout},
+                        sort_keys=True).encode('utf-8')
+    start = -(-(16 + len(header)) // BUNDLE_ALIGN) * BUNDLE_ALIGN
+
+    bundle_dir = os.path.dirname(fn)
+    if not os.path.exists(bundle_dir):
+        os.makedirs(bundle_dir)
+    ## Write to a temporary file first, so that runs reading the old
+    ## bundle (or starting at the same time) never see half of one
+    tmp_fn = '{}.tmp{}'.format(fn, os.getpid())
+    with open(tmp_fn, 'wb') as f:
+        f.write(BUNDLE_MAGIC)
+        f.write(np.array(len(header), dtype='<u8').tobytes())
+        f.write(header)
+        for offset, array in arrays:
+            f.seek(start + offset)
+            f.write(array.tobytes())
+        f.truncate(start + size)
+    os.rename(tmp_fn, fn)
+
+
+def load_vocab_bundle(fn, meta):
+    """
+    The vocabs in a bundle, with their arrays memory-mapped, or None if
+    there is no bundle or it doesn't match `meta`
+    """
+    if not os.path.exists(fn):
+        return None
+    with open(fn, 'rb') as f:
+        if f.read(len(BUNDLE_MAGIC)) != BUNDLE_MAGIC:
+            return None
+        header_len = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    if header['meta'] != meta:
+        return None
+    start = -(-(16 + header_len) // BUNDLE_ALIGN) * BUNDLE_ALIGN
+    data = np.memmap(fn, dtype=np.uint8, mode='r')
+
+    def load(spec):
+        offset, dtype, shape = spec
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        return data[start + offset:start + offset + nbytes].view(
+            dtype).reshape(shape)
+
+    vocabs = {}
+    for vocab_type, entry in header['vocabs'].items():
+        arrays = {name: load(spec) for name, spec in entry['arrays'].items()}
+        vocabs[vocab_type] = Vocab.from_arrays(
+            arrays['words'], arrays['word_counts'], zero=entry['zero'],
+            unk=entry['unk'], version=entry['version'],
+            sorted_idxs=arrays['sorted_idxs'],
+            sorted_words=arrays['sorted_words'])
+    return vocabs
+
+
 def get_vocabs(language='eng', stag_type='ud'):
     """
     Returns a dictionary of Vocab objects for words, parts of speech,
       predicate lemmas, and semantic role labels
+    The vocabs come from the compiled bundle of the language and supertag
+      type, which is (re)built from the text files whenever any of them
+      has changed.
     """
-    vocab_types = ['words', 'pos', 'lemmas', 'plemmas',
-                   'labels', 'stags', 'predicates']
-    vocabs = {}
-    for vocab_type in vocab_types:
-        if vocab_type == 'stags':
-            fn = 'data/{}/vocab/stags.{}.txt'.format(language, stag_type)
-        else:
-            fn = 'data/{}/vocab/{}.txt'.format(language, vocab_type)
-        if vocab_type == 'labels':
-            zero = None
-            unk = None
-        elif vocab_type == 'lemmas' or vocab_type == 'predicates':
-            zero = '_'
-            unk = '<unk>'
-        else:
-            zero = "<zero>"
-            unk = "<unk>"
-        vocabs[vocab_type] = Vocab(fn, zero=zero, unk=unk)
+    meta = get_bundle_meta(language, stag_type)
+    fn = get_bundle_path(language, stag_type)
+    vocabs = load_vocab_bundle(fn, meta)
+    if vocabs is None:
+        vocabs = read_vocabs(language, stag_type)
+        save_vocab_bundle(fn, vocabs, meta)
     return vocabs
-    
+
+
+if __name__ == '__main__':
+    # Usage: python -m util.vocab language stag_type
+    # Compiles the vocab bundle ahead of time
+    language, stag_type = sys.argv[1:3]
+    vocabs = get_vocabs(language, stag_type)
+    print(', '.join('{} {}'.format(len(vocabs[t].words), t)
+                    for t in VOCAB_TYPES))
+    print('Saved to', get_bundle_path(language, stag_type))
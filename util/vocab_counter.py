@@ -0,0 +1,150 @@
+# vocab_counter.py
+# Counts the words of a vocab in bounded memory, for corpora too big to
+# count with a Counter (see util/preprocess.py). Once a counter holds
+# max_entries distinct words, it either
+#   spills them to a run file on disk, sorted by word, and starts again
+#   (exact: the runs are merged when the vocab is written), or
+#   keeps only the max_size most frequent of them (approximate: a word
+#   that was dropped can come back, but its earlier counts are lost)
+# The vocab is written in the same 'word count' format as before, so
+# Vocab reads it as usual.
+from __future__ import print_function
+from __future__ import division
+
+import io
+import os
+import heapq
+import tempfile
+import itertools
+from collections import Counter
+
+## Distinct words held in memory before spilling (or pruning)
+MAX_ENTRIES = 1 << 20
+
+
+def open_run(fn, mode='r'):
+    ## newline='\n' so that words containing '\r' survive the round trip
+    return io.open(fn, mode, encoding='utf-8', newline='\n')
+
+
+def read_run(fn):
+    """(word, count) for each line of a run file"""
+    with open_run(fn) as f:
+        for line in f:
+            word, count = line[:-1].rsplit('\t', 1)
+            yield word, int(count)
+
+
+def write_run(items, spill_dir):
+    """Writes (word, count) pairs to a new run file and returns its name"""
+    fd, fn = tempfile.mkstemp(suffix='.run', dir=spill_dir)
+    os.close(fd)
+    with open_run(fn, 'w') as f:
+        for word, count in items:
+            f.write(u'{}\t{}\n'.format(word, count))
+    return fn
+
+
+def merge_sorted(streams):
+    """Sums the counts of equal words in streams of (word, count) sorted by
+    word"""
+    merged = heapq.merge(*streams)
+    for word, group in itertools.groupby(merged, key=lambda x: x[0]):
+        yield word, sum(count for _, count in group)
+
+
+class VocabCounter(object):
+    """
+    A Counter of words that holds at most `max_entries` of them in memory
+    (see the top of this file). With `max_size` it is approximate and keeps
+    no more than max_size words; otherwise it spills to `spill_dir` (the
+    default temporary directory if None), and the run files are left there
+    for the caller to remove. `transform` maps a list of words to the words
+    that are actually counted (e.g. normalize_column), and is applied to
+    the distinct words seen since the last flush. Counters are picklable
+    once flushed, so workers can hand them back to be merged.
+    """
+    def __init__(self, max_entries=MAX_ENTRIES, max_size=None,
+                 spill_dir=None, transform=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        if max_size is not None:
+            self.max_entries = max(max_entries, 2 * max_size)
+        self.spill_dir = spill_dir
+        self.transform = transform
+        ## Words not transformed yet, and counts of transformed words
+        self.pending = Counter()
+        self.counts = Counter()
+        self.runs = []
+
+    def update(self, words):
+        self.pending.update(words)
+        if len(self.pending) + len(self.counts) >= self.max_entries:
+            self.spill()
+
+    def flush(self):
+        """Moves the pending words into the counts"""
+        if self.transform is None:
+            self.counts.update(self.pending)
+        else:
+            words = list(self.pending)
+            for word, new in zip(words, self.transform(words)):
+                self.counts[new] += self.pending[word]
+        self.pending = Counter()
+        return self
+
+    def spill(self):
+        self.flush()
+        if self.max_size is not None:
+            self.counts = Counter(dict(self.counts.most_common(
+                self.max_size)))
+        elif len(self.counts) >= self.max_entries:
+            self.runs.append(write_run(sorted(self.counts.items()),
+                                       self.spill_dir))
+            self.counts = Counter()
+
+    def merge(self, other):
+        """Adds the counts of another VocabCounter"""
+        self.flush()
+        other.flush()
+        self.runs.extend(other.runs)
+        self.counts.update(other.counts)
+        if len(self.counts) >= self.max_entries:
+            self.spill()
+
+    def __getstate__(self):
+        self.flush()
+        state = dict(self.__dict__)
+        state['transform'] = None
+        return state
+
+    def items(self):
+        """(word, count) for every word, sorted by word"""
+        self.flush()
+        return merge_sorted([read_run(fn) for fn in self.runs] +
+                            [iter(sorted(self.counts.items()))])
+
+    def most_common(self, min_count=1):
+        """
+        (word, count) for each word counted at least min_count times (and
+        not blank), most frequent first and ties in reverse order of the
+        words, like `sort | uniq -c | sort -bnr` in the C locale. Sorts
+        max_entries words at a time in memory.
+        """
+        def key(item):
+            return item[1], item[0]
+        items = ((w, c) for w, c in self.items()
+                 if c >= min_count and w.strip())
+        if self.max_size is not None:
+            return sorted(items, key=key, reverse=True)[:self.max_size]
+        runs = []
+        while True:
+            chunk = sorted(itertools.islice(items, self.max_entries),
+                           key=key, reverse=True)
+            if not runs and len(chunk) < self.max_entries:
+                return chunk
+            if not chunk:
+                break
+            runs.append(write_run(chunk, self.spill_dir))
+        return heapq.merge(*[read_run(fn) for fn in runs], key=key,
+                           reverse=True)